@@ -0,0 +1,257 @@
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+from itertools import takewhile
+from sqlalchemy import and_, bindparam, case, or_, select
+from sqlalchemy.orm import aliased
+from models import db, Message, MessageArchiveBlock, ConversationSummary
+from expiry import DELETE_BATCH_SIZE, utcnow
+
+logger = logging.getLogger(__name__)
+
+# hot/cold tiering for messages. The message table (and its indexes) only keeps recent
+# history; older messages are packed into per-conversation blocks in the archive
+# database (config.ARCHIVE_DATABASE_URL) and get_conversation reads across both tiers
+# when a client pages back that far. Only messages the recipient has read move, and a
+# conversation's newest message always stays hot, so unread counts, badges and the
+# inbox never need the archive. Archived messages drop out of full-text search
+
+COMPRESSION_LEVEL = 6
+
+
+def pair_key(user_id, peer_id):
+    return (user_id, peer_id) if user_id < peer_id else (peer_id, user_id)
+
+
+def _pack(rows):
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), COMPRESSION_LEVEL)
+
+
+def _unpack(data):
+    # [[id, sender_id, recipient_id, content, created_at], ...] oldest first
+    return json.loads(zlib.decompress(data))
+
+
+def _message_dict(row):
+    # same shape as Message.to_dict(); read is filled in from the read marks
+    message_id, sender_id, recipient_id, content, created_at = row
+    return {
+        'id': message_id,
+        'sender_id': sender_id,
+        'recipient_id': recipient_id,
+        'content': content,
+        'read': False,
+        'created_at': created_at
+    }
+
+
+def _candidates(after_id, limit):
+    # the next messages in id order, flagged archivable when the recipient's read mark
+    # covers them and they aren't the conversation's newest message
+    reader = aliased(ConversationSummary)
+    archivable = and_(Message.id <= reader.last_read_message_id, Message.id < reader.last_message_id)
+    return db.session.execute(select(
+        Message.id, Message.sender_id, Message.recipient_id, Message.content, Message.created_at,
+        archivable.label('archivable')
+    ).outerjoin(reader, and_(
+        reader.user_id == Message.recipient_id,
+        reader.peer_id == Message.sender_id
+    )).where(Message.id > after_id).order_by(Message.id).limit(limit)).all()
+
+
+def _write_blocks(by_pair, block_size):
+    # appends to each conversation's partly filled block before starting new ones,
+    # so paging back only has to open a block or two per page
+    open_blocks = {
+        (block.user_low, block.user_high): block
+        for block in MessageArchiveBlock.query.filter(
+            MessageArchiveBlock.message_count < block_size,
+            or_(*(
+                and_(MessageArchiveBlock.user_low == low, MessageArchiveBlock.user_high == high)
+                for low, high in by_pair
+            ))
+        )
+    }
+    written = 0
+    for (low, high), rows in by_pair.items():
+        block = open_blocks.get((low, high))
+        if block is not None:
+            existing = {row[0]: row for row in _unpack(block.data)}
+            existing.update((row[0], row) for row in rows)
+            rows = [existing[message_id] for message_id in sorted(existing)]
+        for start in range(0, len(rows), block_size):
+            chunk = rows[start:start + block_size]
+            if block is None:
+                block = MessageArchiveBlock(user_low=low, user_high=high)
+                db.session.add(block)
+            block.first_message_id = chunk[0][0]
+            block.last_message_id = chunk[-1][0]
+            block.message_count = len(chunk)
+            block.data = _pack(chunk)
+            block = None
+            written += 1
+    return written
+
+
+def _archive_batch(rows, block_size):
+    by_pair = defaultdict(list)
+    for row in rows:
+        by_pair[pair_key(row.sender_id, row.recipient_id)].append(
+            [row.id, row.sender_id, row.recipient_id, row.content, row.created_at.isoformat()]
+        )
+
+    # cold tier first: a crash before the hot delete leaves the messages in both tiers,
+    # which readers dedupe by id, instead of losing them
+    blocks = _write_blocks(by_pair, block_size)
+    db.session.commit()
+
+    ids = [row.id for row in rows]
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        Message.query.filter(Message.id.in_(ids[start:start + DELETE_BATCH_SIZE])).delete(
+            synchronize_session=False
+        )
+    summaries = ConversationSummary.__table__
+    newest = bindparam('newest')
+    params = []
+    for (low, high), pair_rows in by_pair.items():
+        archived = pair_rows[-1][0]
+        params.append({'reader': low, 'peer': high, 'newest': archived})
+        params.append({'reader': high, 'peer': low, 'newest': archived})
+    db.session.execute(summaries.update().where(
+        summaries.c.user_id == bindparam('reader'),
+        summaries.c.peer_id == bindparam('peer')
+    ).values(last_archived_message_id=case(
+        (summaries.c.last_archived_message_id < newest, newest),
+        else_=summaries.c.last_archived_message_id
+    )), params)
+    db.session.commit()
+    return blocks
+
+
+def archive_messages(cutoff, batch_size=2000, block_size=200):
+    # move read messages created before cutoff to the archive, oldest first; returns
+    # (messages archived, blocks written). ids grow with created_at, so the walk stops at
+    # the first message that is too new. Unread messages and each conversation's newest
+    # message are stepped over and looked at again on the next run
+    archived = 0
+    blocks = 0
+    after_id = 0
+    while True:
+        rows = _candidates(after_id, batch_size)
+        old = list(takewhile(lambda row: row.created_at < cutoff, rows))
+        batch = [row for row in old if row.archivable]
+        if batch:
+            blocks += _archive_batch(batch, block_size)
+            archived += len(batch)
+        if len(old) < batch_size:
+            return archived, blocks
+        after_id = rows[-1].id
+
+
+def archived_messages(user_id, peer_id, after_id=None, before_id=None, limit=None):
+    # the conversation's archived messages as Message.to_dict() dicts, oldest first.
+    # With after_id (walking forward) or before_id/limit (walking back) only the `limit`
+    # messages nearest the cursor; blocks are opened in cursor order until no further
+    # block can hold a nearer message. Only the block ranges are sorted, each block's data
+    # is read by primary key when it is opened
+    low, high = pair_key(user_id, peer_id)
+    forward = after_id is not None
+    query = select(
+        MessageArchiveBlock.id, MessageArchiveBlock.first_message_id, MessageArchiveBlock.last_message_id
+    ).where(MessageArchiveBlock.user_low == low, MessageArchiveBlock.user_high == high)
+    if forward:
+        query = query.where(MessageArchiveBlock.last_message_id > after_id).order_by(
+            MessageArchiveBlock.first_message_id.asc()
+        )
+    else:
+        if before_id is not None:
+            query = query.where(MessageArchiveBlock.first_message_id < before_id)
+        query = query.order_by(MessageArchiveBlock.last_message_id.desc())
+
+    found = {}
+    for block_id, first_id, last_id in db.session.execute(query).all():
+        if limit is not None and len(found) >= limit:
+            nearest = sorted(found, reverse=not forward)[limit - 1]
+            if (first_id > nearest) if forward else (last_id < nearest):
+                break
+        data = db.session.execute(
+            select(MessageArchiveBlock.data).where(MessageArchiveBlock.id == block_id)
+        ).scalar_one()
+        for row in _unpack(data):
+            if (after_id is None or row[0] > after_id) and (before_id is None or row[0] < before_id):
+                found[row[0]] = row
+
+    ids = sorted(found)
+    if limit is not None:
+        ids = ids[:limit] if forward else ids[-limit:]
+    return [_message_dict(found[message_id]) for message_id in ids]
+
+
+class ArchiveScheduler:
+    def __init__(self, interval=3600):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            'running': False,
+            'runs': 0,
+            'messages_archived_total': 0,
+            'last_run_at': None,
+            'last_run_seconds': None,
+            'last_archived': 0
+        }
+
+    def run_once(self, config):
+        now = utcnow()
+        started = time.perf_counter()
+        archived, blocks = archive_messages(
+            now - timedelta(days=config['ARCHIVE_AFTER_DAYS']),
+            config['ARCHIVE_BATCH_SIZE'],
+            config['ARCHIVE_BLOCK_SIZE']
+        )
+        elapsed = time.perf_counter() - started
+        if archived:
+            logger.info('archived messages', extra={'messages': archived, 'blocks': blocks, 'seconds': elapsed})
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['messages_archived_total'] += archived
+            self._stats['last_run_at'] = now.isoformat()
+            self._stats['last_run_seconds'] = elapsed
+            self._stats['last_archived'] = archived
+        return archived
+
+    def run_forever(self, app):
+        self._stats['running'] = True
+        try:
+            while not self._stop.is_set():
+                try:
+                    with app.app_context():
+                        self.run_once(app.config)
+                except Exception:
+                    logger.exception('error archiving messages')
+                self._stop.wait(self.interval)
+        finally:
+            self._stats['running'] = False
+
+    def start(self, app):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.interval = app.config['ARCHIVE_INTERVAL_SECONDS']
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, args=(app,), name='message-archive', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+archiver = ArchiveScheduler()
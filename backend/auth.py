@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify
 from models import db, User
+from cache import user_cache
+from user_search import username_index
 from werkzeug.security import generate_password_hash, check_password_hash
 
 auth = Blueprint('auth', __name__)
@@ -27,6 +29,8 @@ def register():
 
     db.session.add(new_user)
     db.session.commit()
+    user_cache.invalidate(new_user.id)
+    username_index.add(new_user.id, new_user.username)
 
     return jsonify({"message": "User registered successfully", "user": new_user.to_dict()}), 201
 
@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+import uuid
+
+# Endpoint benchmark. Drives every route through the Flask test client against a
+# database built by datagen.py and reports latency percentiles, SQL queries per request
+# and rows fetched from SQLite per request. Results can be saved and compared to a
+# baseline run.
+#
+#   python datagen.py --database sqlite:////tmp/bench.db --scale medium
+#   python benchmark.py --database sqlite:////tmp/bench.db --save baseline.json
+#   ... change something ...
+#   python benchmark.py --database sqlite:////tmp/bench.db --baseline baseline.json
+#
+# write routes create the rows they consume (untimed) so repeated runs keep the data
+# roughly stable; /stream is skipped because it never completes
+
+PASSWORD = 'password123'
+
+
+class _Counters:
+    queries = 0
+    rows = 0
+
+
+class CountingCursor(sqlite3.Cursor):
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _Counters.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        _Counters.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _Counters.rows += len(rows)
+        return rows
+
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class Bench:
+    def __init__(self, app, rng):
+        from models import db
+        self.app = app
+        self.db = db
+        self.rng = rng
+
+    # untimed helpers used to pick parameters and create rows a route will consume
+
+    def random_id(self, model, **filters):
+        with self.app.app_context():
+            query = self.db.session.query(model.id).filter_by(**filters)
+            low, high = self.db.session.query(
+                self.db.func.min(model.id), self.db.func.max(model.id)
+            ).filter_by(**filters).one()
+            if low is None:
+                return None
+            return query.filter(model.id >= self.rng.randint(low, high)).order_by(model.id).limit(1).scalar()
+
+    def random_row(self, model, **filters):
+        row_id = self.random_id(model, **filters)
+        with self.app.app_context():
+            row = self.db.session.get(model, row_id)
+            return {c.name: getattr(row, c.name) for c in model.__table__.columns}
+
+    def insert(self, model, **values):
+        with self.app.app_context():
+            row = model(**values)
+            self.db.session.add(row)
+            self.db.session.commit()
+            return row.id
+
+    def user_id(self):
+        from models import User
+        return self.random_id(User)
+
+    def username(self, user_id):
+        from models import User
+        with self.app.app_context():
+            return self.db.session.get(User, user_id).username
+
+
+def route_cases():
+    from models import Group, GroupMember, Move, Friendship, GroupInvitation
+
+    def register(b):
+        name = f'bench_{uuid.uuid4().hex[:12]}'
+        return 'POST', '/auth/register', {'username': name, 'email': f'{name}@example.com', 'password': PASSWORD}
+
+    def login(b):
+        return 'POST', '/auth/login', {'username': b.username(b.user_id()), 'password': PASSWORD}
+
+    def send_friend_request(b):
+        return 'POST', '/friends/request', {'user_id': b.user_id(), 'friend_username': b.username(b.user_id())}
+
+    def accept_friend_request(b):
+        friendship_id = b.insert(Friendship, user_id=b.user_id(), friend_id=b.user_id(), status='pending')
+        return 'POST', f'/friends/accept/{friendship_id}', None
+
+    def remove_friend(b):
+        friendship_id = b.insert(Friendship, user_id=b.user_id(), friend_id=b.user_id(), status='accepted')
+        return 'DELETE', f'/friends/remove/{friendship_id}', None
+
+    def create_group(b):
+        return 'POST', '/groups/groups', {'name': 'Bench Group', 'created_by': b.user_id()}
+
+    def join_group(b):
+        group = b.random_row(Group)
+        return 'POST', '/groups/join', {'join_key': group['join_key'], 'user_id': b.user_id()}
+
+    def send_group_invitation(b):
+        member = b.random_row(GroupMember)
+        return 'POST', f"/groups/{member['group_id']}/add-member", {'user_id': b.user_id(), 'added_by': member['user_id']}
+
+    def send_group_invitations_batch(b):
+        member = b.random_row(GroupMember)
+        user_ids = [b.user_id() for _ in range(20)]
+        return 'POST', f"/groups/{member['group_id']}/invitations/batch", {'user_ids': user_ids, 'added_by': member['user_id']}
+
+    def invitation(b):
+        member = b.random_row(GroupMember)
+        return b.insert(GroupInvitation, group_id=member['group_id'], user_id=b.user_id(),
+                        invited_by=member['user_id'], status='pending')
+
+    def update_group_settings(b):
+        group = b.random_row(Group)
+        return 'PUT', f"/groups/{group['id']}/settings", {
+            'user_id': group['created_by'], 'min_votes_required': group['min_votes_required']
+        }
+
+    def create_move(b):
+        member = b.random_row(GroupMember)
+        return 'POST', f"/api/groups/{member['group_id']}/moves", {
+            'name': 'Bench move', 'description': 'created by benchmark.py', 'created_by': member['user_id']
+        }
+
+    def new_move(b):
+        member = b.random_row(GroupMember)
+        return b.insert(Move, name='Bench move', group_id=member['group_id'], created_by=member['user_id'])
+
+    def update_move(b):
+        move = b.random_row(Move)
+        return 'PUT', f"/api/moves/{move['id']}", {'name': move['name']}
+
+    def toggle_vote(b):
+        member = b.random_row(GroupMember)
+        move_id = b.random_id(Move, group_id=member['group_id']) or b.random_id(Move)
+        return 'POST', f'/votes/move/{move_id}/vote', {'user_id': member['user_id']}
+
+    def friend_pair(b):
+        friendship = b.random_row(Friendship, status='accepted')
+        return friendship['user_id'], friendship['friend_id']
+
+    def send_message(b):
+        sender, recipient = friend_pair(b)
+        return 'POST', '/messages/send', {'sender_id': sender, 'recipient_id': recipient, 'content': 'bench'}
+
+    def conversation(query=''):
+        def case(b):
+            user1, user2 = friend_pair(b)
+            return 'GET', f'/messages/conversation/{user1}/{user2}{query}', None
+        return case
+
+    return [
+        ('auth.register', register),
+        ('auth.login', login),
+        ('friends.send_friend_request', send_friend_request),
+        ('friends.get_friends', lambda b: ('GET', f'/friends/user/{b.user_id()}', None)),
+        ('friends.get_friend_requests', lambda b: ('GET', f'/friends/user/{b.user_id()}/requests', None)),
+        ('friends.accept_friend_request', accept_friend_request),
+        ('friends.remove_friend', remove_friend),
+        ('friends.get_mutual_friends', lambda b: ('GET', f'/friends/mutual/{b.user_id()}?current_user_id={b.user_id()}', None)),
+        ('friends.get_friend_suggestions', lambda b: ('GET', f'/friends/suggestions/{b.user_id()}', None)),
+        ('friends.search_users', lambda b: ('GET', f'/friends/search?q={b.username(b.user_id())[:5]}&user_id={b.user_id()}', None)),
+        ('friends.search_users?fuzzy', lambda b: ('GET', f'/friends/search?q=usr{b.rng.randint(1, 999)}', None)),
+        ('friends.get_user_profile', lambda b: ('GET', f'/friends/profile/{b.user_id()}?current_user_id={b.user_id()}', None)),
+        ('groups.get_user_groups', lambda b: ('GET', f'/groups/user/{b.user_id()}/groups', None)),
+        ('groups.create_group', create_group),
+        ('groups.join_group_by_key', join_group),
+        ('groups.send_group_invitation', send_group_invitation),
+        ('groups.send_group_invitations_batch', send_group_invitations_batch),
+        ('groups.get_group_invitations', lambda b: ('GET', f'/groups/user/{b.user_id()}/invitations', None)),
+        ('groups.accept_group_invitation', lambda b: ('POST', f'/groups/invitations/{invitation(b)}/accept', None)),
+        ('groups.decline_group_invitation', lambda b: ('POST', f'/groups/invitations/{invitation(b)}/decline', None)),
+        ('groups.get_group_settings', lambda b: ('GET', f'/groups/{b.random_id(Group)}/settings', None)),
+        ('groups.update_group_settings', update_group_settings),
+        ('groups.get_group_board', lambda b: ('GET', f'/groups/{b.random_id(Group)}/board', None)),
+        ('groups.cleanup_expired_moves', lambda b: ('POST', f'/groups/{b.random_id(Group)}/cleanup-moves', None)),
+        ('groups.get_member_count', lambda b: ('GET', f'/groups/{b.random_id(Group)}/member-count', None)),
+        ('api.get_moves', lambda b: ('GET', f'/api/groups/{b.random_id(Group)}/moves', None)),
+        ('api.get_moves_trending', lambda b: ('GET', f'/api/groups/{b.random_id(Group)}/moves?sort=trending&limit=20', None)),
+        ('api.search_group_moves', lambda b: ('GET', f'/api/groups/{b.random_id(Group)}/moves/search?q=pizza', None)),
+        ('api.create_move', create_move),
+        ('api.update_move', update_move),
+        ('api.delete_move', lambda b: ('DELETE', f'/api/moves/{new_move(b)}', None)),
+        ('api.test_delete', lambda b: ('GET', f'/api/test-delete/{new_move(b)}', None)),
+        ('votes.toggle_vote', toggle_vote),
+        ('votes.get_move_votes', lambda b: ('GET', f'/votes/move/{b.random_id(Move)}', None)),
+        ('votes.get_group_votes', lambda b: ('GET', f'/votes/group/{b.random_id(Group)}', None)),
+        ('messages.send_message', send_message),
+        ('messages.get_conversation', conversation()),
+        ('messages.get_conversation?limit=50', conversation('?limit=50')),
+        ('messages.search_user_messages', lambda b: ('GET', f'/messages/user/{b.user_id()}/search?q=pizza', None)),
+        ('users.get_badges', lambda b: ('GET', f'/user/{b.user_id()}/badges', None)),
+        ('messages.get_user_conversations', lambda b: ('GET', f'/messages/user/{b.user_id()}/conversations', None)),
+    ]
+
+
+def run(app, requests, rng, only=None, log=print):
+    bench = Bench(app, rng)
+    client = app.test_client()
+    results = {}
+    for name, case in route_cases():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        latencies, queries, rows, statuses = [], [], [], {}
+        for _ in range(requests):
+            method, path, body = case(bench)
+            _Counters.queries = _Counters.rows = 0
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(_Counters.queries)
+            rows.append(_Counters.rows)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        results[name] = {
+            'requests': requests,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'queries': sum(queries) / requests,
+            'rows': sum(rows) / requests,
+            'statuses': statuses
+        }
+        log(format_row(name, results[name]))
+    return results
+
+
+def format_row(name, r, baseline=None):
+    line = (f"{name:<38} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+            f"{r['queries']:7.1f} {r['rows']:9.1f}  {','.join(sorted(r['statuses']))}")
+    if baseline:
+        def delta(key):
+            before = baseline[key]
+            return f"{(r[key] - before) / before * 100:+6.0f}%" if before else '     -'
+        line += f"   p50 {delta('p50_ms')}  p95 {delta('p95_ms')}  queries {delta('queries')}  rows {delta('rows')}"
+    return line
+
+
+def header():
+    return f"{'route':<38} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>7} {'rows':>9}  status"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every Moves route.')
+    parser.add_argument('--database', required=True, help='SQLAlchemy URL of a datagen.py database')
+    parser.add_argument('--requests', type=int, default=50, help='requests per route')
+    parser.add_argument('--route', action='append', help='only run routes starting with this name (repeatable)')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.database.startswith('sqlite'):
+        raise SystemExit('benchmark.py counts rows through the sqlite3 driver, use a sqlite:/// URL')
+    os.environ['DATABASE_URL'] = args.database
+
+    from sqlalchemy import event
+    from factory import create_app
+    from config import Config
+    from models import db
+    from graph import friend_graph
+    from user_search import username_index
+
+    class BenchConfig(Config):
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'factory': CountingConnection, 'check_same_thread': False}}
+        # every route is hit back to back from a handful of ids
+        RATELIMIT_ENABLED = False
+        LOAD_SHED_DB_LATENCY_MS = None
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        # built once per process, keep the load out of the first timed request
+        friend_graph.load()
+        username_index.load()
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            _Counters.queries += 1
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+
+    print(header())
+    results = run(app, args.requests, random.Random(args.seed), args.route)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['routes']
+        print()
+        print('compared to', args.baseline)
+        for name, r in results.items():
+            print(format_row(name, r, baseline.get(name)))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'database': args.database, 'requests': args.requests, 'routes': results}, f, indent=2)
+        print(f"saved to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import click
+from flask import current_app
+from messages_routes import rebuild_conversation_summaries
+from votes_routes import reconcile_vote_counts
+from migrations import MIGRATIONS, applied_versions, upgrade
+from expiry import ExpiryScheduler, backfill_expires_at, sweep_expired_moves, utcnow
+from archive import ArchiveScheduler
+from search import rebuild_search_indexes, FTS_TABLES, SHARD_FTS_TABLES
+from users_routes import rebuild_user_counters
+from sharding import move_group, plan_rebalance
+from shard_router import shard_engines
+
+# maintenance commands, run with `flask --app app <command>`
+
+@click.command('rebuild-conversations')
+def rebuild_conversations_command():
+    # backfill the conversation inbox summaries from the Message table
+    count = rebuild_conversation_summaries()
+    click.echo(f"Rebuilt {count} conversation summaries")
+
+@click.command('expire-moves')
+def expire_moves_command():
+    # one-off sweep, e.g. from cron
+    backfilled = backfill_expires_at()
+    moves_swept, votes_deleted = sweep_expired_moves(utcnow())
+    click.echo(f"Backfilled {backfilled} deadlines, deleted {moves_swept} move(s) and {votes_deleted} vote(s)")
+
+@click.command('expiry-worker')
+@click.option('--max-interval', default=60, help='Longest sleep between sweeps, in seconds.')
+def expiry_worker_command(max_interval):
+    # run the expiry scheduler in the foreground instead of inside the web process
+    worker = ExpiryScheduler(max_interval=max_interval)
+    click.echo("Expiry worker started")
+    try:
+        worker.run_forever(current_app._get_current_object())
+    except KeyboardInterrupt:
+        pass
+    click.echo(f"Expiry worker stopped: {worker.stats()}")
+
+@click.command('archive-messages')
+@click.option('--older-than-days', type=int, default=None, help='Defaults to ARCHIVE_AFTER_DAYS.')
+def archive_messages_command(older_than_days):
+    # one-off archival run, e.g. from cron
+    config = dict(current_app.config)
+    if older_than_days is not None:
+        config['ARCHIVE_AFTER_DAYS'] = older_than_days
+    worker = ArchiveScheduler()
+    archived = worker.run_once(config)
+    click.echo(f"Archived {archived} message(s) in {worker.stats()['last_run_seconds']:.1f}s")
+
+@click.command('reconcile-votes')
+def reconcile_votes_command():
+    # rebuild Move.vote_count from the Vote table
+    duplicates, updated = reconcile_vote_counts()
+    click.echo(f"Removed {duplicates} duplicate vote(s), recounted {updated} move(s)")
+
+@click.command('migrate')
+def migrate_command():
+    # apply pending schema migrations and list their status
+    applied = upgrade()
+    done = applied_versions()
+    for version, description, _ in MIGRATIONS:
+        status = 'applied now' if version in applied else ('applied' if version in done else 'pending')
+        click.echo(f"{version:>3}  {status:<12} {description}")
+
+@click.command('rebuild-search')
+def rebuild_search_command():
+    # rebuild the full-text indexes from the message and move tables, move search on every shard
+    for shard, engine in shard_engines():
+        with engine.begin() as conn:
+            rebuild_search_indexes(conn, SHARD_FTS_TABLES if shard else FTS_TABLES)
+    click.echo("Rebuilt message and move search indexes")
+
+@click.command('rebuild-badges')
+def rebuild_badges_command():
+    # recompute every user's badge counters from the tables
+    count = rebuild_user_counters()
+    click.echo(f"Rebuilt badge counters for {count} user(s)")
+
+@click.command('move-group')
+@click.argument('group_id', type=int)
+@click.argument('shard', type=int)
+@click.option('--settle', type=float, default=None,
+              help='Seconds to wait for other workers to stop using the group, defaults to the directory TTL + 1.')
+def move_group_command(group_id, shard, settle):
+    # move one group's moves, votes, members and invitations to another shard;
+    # rerunning it finishes an interrupted move
+    copied = move_group(group_id, shard, settle)
+    click.echo(f"Group {group_id} is on shard {shard}, copied {sum(copied.values())} row(s)")
+
+@click.command('rebalance-shards')
+@click.option('--dry-run', is_flag=True, help='Only print the moves.')
+@click.option('--settle', type=float, default=None, help='Passed on to each move, see move-group.')
+def rebalance_shards_command(dry_run, settle):
+    # even out the number of groups per shard, one group at a time
+    plan = plan_rebalance()
+    for group_id, source, target in plan:
+        click.echo(f"group {group_id}: shard {source} -> {target}")
+        if not dry_run:
+            move_group(group_id, target, settle)
+    click.echo(f"{'Would move' if dry_run else 'Moved'} {len(plan)} group(s)")
+
+def register_commands(app):
+    app.cli.add_command(rebuild_conversations_command)
+    app.cli.add_command(expire_moves_command)
+    app.cli.add_command(expiry_worker_command)
+    app.cli.add_command(archive_messages_command)
+    app.cli.add_command(reconcile_votes_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(rebuild_badges_command)
+    app.cli.add_command(move_group_command)
+    app.cli.add_command(rebalance_shards_command)
@@ -0,0 +1,116 @@
+import os
+
+# app settings, every value can be overridden from the environment
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def _sibling_url(uri, name):
+    # a database file next to the main one: moves.db -> moves_<name>.db
+    if not uri.startswith('sqlite'):
+        return uri
+    if ':memory:' in uri or uri.rstrip('/') in ('sqlite:', 'sqlite://'):
+        return 'sqlite://'
+    root, ext = os.path.splitext(uri)
+    return f"{root}_{name}{ext or '.db'}"
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///moves.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000').split(',')
+
+    # hot/cold message tiering (see archive.py): read messages older than
+    # ARCHIVE_AFTER_DAYS move out of the message table into compressed blocks in a
+    # separate database, checked every ARCHIVE_INTERVAL_SECONDS
+    ARCHIVE_DATABASE_URL = os.environ.get('ARCHIVE_DATABASE_URL') or _sibling_url(SQLALCHEMY_DATABASE_URI, 'archive')
+    ARCHIVE_AFTER_DAYS = _env_int('ARCHIVE_AFTER_DAYS', 90)
+    ARCHIVE_BATCH_SIZE = _env_int('ARCHIVE_BATCH_SIZE', 2000)
+    ARCHIVE_BLOCK_SIZE = _env_int('ARCHIVE_BLOCK_SIZE', 200)
+    ARCHIVE_INTERVAL_SECONDS = _env_int('ARCHIVE_INTERVAL_SECONDS', 3600)
+
+    # group data sharding (see sharding.py): each group's moves, votes, members and
+    # invitations live in one database. Shard 0 is the main database, every URL in
+    # SHARD_DATABASE_URLS (comma separated) adds a shard; other workers see a group
+    # move to another shard within SHARD_DIRECTORY_TTL_SECONDS. Id blocks for sharded
+    # rows are reserved in a database of their own, so a reservation never waits on a
+    # request that already holds the main database's write lock
+    SHARD_DATABASE_URLS = [url for url in os.environ.get('SHARD_DATABASE_URLS', '').split(',') if url]
+    SHARD_DIRECTORY_TTL_SECONDS = _env_int('SHARD_DIRECTORY_TTL_SECONDS', 5)
+    SHARD_ID_DATABASE_URL = os.environ.get('SHARD_ID_DATABASE_URL') or _sibling_url(SQLALCHEMY_DATABASE_URI, 'ids')
+
+    SQLALCHEMY_BINDS = {
+        'archive': ARCHIVE_DATABASE_URL,
+        'ids': SHARD_ID_DATABASE_URL,
+        **{f'shard{shard}': url for shard, url in enumerate(SHARD_DATABASE_URLS, 1)}
+    }
+
+    # applied to every new SQLite connection: WAL lets readers run while a write
+    # (send_message, toggle_vote, ...) is in progress, NORMAL sync is safe under WAL,
+    # and busy_timeout makes writers wait for the lock instead of failing immediately
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+    # connection pool per worker process; SSE streams don't hold a connection,
+    # so this only needs to cover the worker's request threads
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 5)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 10)
+    DB_POOL_TIMEOUT = _env_int('DB_POOL_TIMEOUT', 30)
+    DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 3600)
+
+    # requests slower than this are logged with the SQL they ran (0 turns it off)
+    SLOW_REQUEST_MS = _env_int('SLOW_REQUEST_MS', 500) or None
+    SLOW_REQUEST_MAX_STATEMENTS = _env_int('SLOW_REQUEST_MAX_STATEMENTS', 50)
+
+    # opt-in request profiling (see profiling.py): sample a fraction of requests, or
+    # keep a profile of every request slower than PROFILE_SLOW_MS
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SLOW_MS = _env_int('PROFILE_SLOW_MS', 0) or None
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    PROFILE_KEEP = _env_int('PROFILE_KEEP', 50)
+    PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN')
+
+    # JSON logs go through a queue to a writer thread (see logs.py); DEBUG records are
+    # sampled so turning on debug logging under load doesn't flood the output
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01))
+    LOG_QUEUE_SIZE = _env_int('LOG_QUEUE_SIZE', 10000)
+
+    # responses at least this large are gzip/brotli compressed when the client accepts it
+    COMPRESS_MIN_SIZE = _env_int('COMPRESS_MIN_SIZE', 1024)
+    COMPRESS_GZIP_LEVEL = _env_int('COMPRESS_GZIP_LEVEL', 5)
+    COMPRESS_BROTLI_QUALITY = _env_int('COMPRESS_BROTLI_QUALITY', 4)
+
+    # token buckets per client per endpoint as (requests per second, burst), keyed by
+    # endpoint or blueprint, the most specific key wins and None means unlimited; reads
+    # are shed with 503 once SQL statements average over LOAD_SHED_DB_LATENCY_MS
+    # (see ratelimit.py)
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMITS = {
+        'default': (20, 40),
+        'metrics': None,
+        'auth': (1, 10),
+        'messages.get_conversation': (2, 10),  # chat polling
+        'messages.send_message': (2, 10),
+        'votes.toggle_vote': (2, 5),
+        # one shared connection per tab (frontend eventStream.js); room for reloads and
+        # reconnects, since EventSource gives up after a 429
+        'stream.stream_user_events': (1, 30),
+        'groups.send_group_invitations_batch': (0.2, 2),
+    }
+    LOAD_SHED_DB_LATENCY_MS = _env_int('LOAD_SHED_DB_LATENCY_MS', 100) or None
+
+    # where /stream events go between processes (see events.py): 'memory://' keeps them
+    # in this process, 'sqlite:///path' shares them with every worker on the host
+    EVENTS_STORAGE_URL = os.environ.get('EVENTS_STORAGE_URL', 'memory://')
+
+class ProductionConfig(Config):
+    DEBUG = False
+    # gunicorn runs several workers and expiry runs in a process of its own, so events
+    # go through a file next to the main database unless EVENTS_STORAGE_URL says otherwise
+    EVENTS_STORAGE_URL = os.environ.get('EVENTS_STORAGE_URL') or _sibling_url(Config.SQLALCHEMY_DATABASE_URI, 'events')
+    # sized for gunicorn.conf.py's request threads per worker, plus headroom for the
+    # expiry scheduler; stream threads don't hold a connection
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 10)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 5)
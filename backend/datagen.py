@@ -0,0 +1,212 @@
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+# Synthetic data generator for benchmarking. Bulk-inserts configurable volumes in
+# batched executemany calls, then rebuilds the denormalized tables and counters the
+# write paths normally maintain.
+#
+#   python datagen.py --database sqlite:///bench.db --scale large
+#   python datagen.py --database sqlite:///bench.db --users 5000 --messages 100000
+#
+# every generated user's password is "password123", like seed.py
+
+SCALES = {
+    'small': {'users': 1000, 'groups': 100, 'messages': 10000, 'votes': 20000},
+    'medium': {'users': 20000, 'groups': 2000, 'messages': 200000, 'votes': 500000},
+    'large': {'users': 100000, 'groups': 10000, 'messages': 1000000, 'votes': 5000000},
+}
+
+BATCH_SIZE = 10000
+PASSWORD = 'password123'
+WORDS = ('pizza', 'hike', 'movie', 'beach', 'tonight', 'tomorrow', 'brunch', 'game', 'concert',
+         'coffee', 'park', 'run', 'museum', 'karaoke', 'trivia', 'road', 'trip', 'dinner', 'lol', 'ok')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic Moves database.')
+    parser.add_argument('--database', required=True, help='SQLAlchemy URL, e.g. sqlite:///bench.db')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--groups', type=int)
+    parser.add_argument('--messages', type=int)
+    parser.add_argument('--votes', type=int)
+    parser.add_argument('--members-per-group', type=int, default=20)
+    parser.add_argument('--friends-per-user', type=int, default=10)
+    parser.add_argument('--pending-invitations', type=float, default=0.1,
+                        help='pending group invitations per user')
+    parser.add_argument('--days', type=int, default=30, help='spread created_at over this many days')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    for key, value in SCALES[args.scale].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    return args
+
+
+def batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_all(db, table, rows):
+    count = 0
+    for batch in batched(rows):
+        db.session.execute(table.insert(), batch)
+        count += len(batch)
+    db.session.commit()
+    return count
+
+
+def generate(args, log=print):
+    from werkzeug.security import generate_password_hash
+    from migrations import upgrade
+    from shard_router import use_shard
+    from models import (db, User, Group, GroupMember, Move, Vote, Friendship,
+                        GroupInvitation, Message)
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start = now - timedelta(days=args.days)
+    span = args.days * 86400
+    password_hash = generate_password_hash(PASSWORD)
+
+    def timestamp(fraction=None):
+        return start + timedelta(seconds=span * (rng.random() if fraction is None else fraction))
+
+    def step(name, table, rows):
+        started = time.perf_counter()
+        count = insert_all(db, table, rows)
+        log(f"{name:<20} {count:>10,} rows  {time.perf_counter() - started:7.1f}s")
+        return count
+
+    db.drop_all()
+    upgrade()
+    # every group starts on shard 0, the main database; `flask rebalance-shards`
+    # spreads them out when extra shards are configured
+    use_shard(0)
+
+    step('users', User.__table__, ({
+        'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com',
+        'password_hash': password_hash, 'created_at': timestamp()
+    } for i in range(1, args.users + 1)))
+
+    members = {}
+    for group_id in range(1, args.groups + 1):
+        size = min(args.users, max(2, int(rng.gauss(args.members_per_group, args.members_per_group / 4))))
+        members[group_id] = rng.sample(range(1, args.users + 1), size)
+
+    step('groups', Group.__table__, ({
+        'id': group_id, 'name': f'Group {group_id}', 'created_by': members[group_id][0],
+        'join_key': f'key{group_id}', 'min_votes_required': rng.choice((2, 3, 3, 5)),
+        'vote_deadline_hours': rng.choice((24, 24, 48, 168)), 'created_at': start
+    } for group_id in range(1, args.groups + 1)))
+
+    step('group members', GroupMember.__table__, ({
+        'group_id': group_id, 'user_id': user_id, 'joined_at': start
+    } for group_id, user_ids in members.items() for user_id in user_ids))
+
+    # enough moves that an average of half the members voting reaches the vote target
+    deadlines = dict(db.session.query(Group.id, Group.vote_deadline_hours).all())
+    move_count = max(args.groups, (2 * args.votes) // max(1, args.members_per_group))
+    moves = []
+    for move_id in range(1, move_count + 1):
+        group_id = rng.randint(1, args.groups)
+        created_at = timestamp(move_id / move_count)
+        moves.append({
+            'id': move_id, 'name': f'{rng.choice(WORDS)} {rng.choice(WORDS)}',
+            'description': ' '.join(rng.choice(WORDS) for _ in range(8)),
+            'group_id': group_id, 'created_by': rng.choice(members[group_id]),
+            'created_at': created_at,
+            'expires_at': created_at + timedelta(hours=deadlines[group_id]),
+            'vote_count': 0
+        })
+    step('moves', Move.__table__, moves)
+
+    def votes():
+        remaining = args.votes
+        for move in moves:
+            if remaining <= 0:
+                return
+            voters = members[move['group_id']]
+            for user_id in rng.sample(voters, min(remaining, rng.randint(0, len(voters)))):
+                remaining -= 1
+                yield {'move_id': move['id'], 'user_id': user_id, 'created_at': move['created_at']}
+    step('votes', Vote.__table__, votes())
+
+    pairs = set()
+    target = args.users * args.friends_per_user // 2
+    while len(pairs) < target and args.users > 1:
+        a, b = rng.sample(range(1, args.users + 1), 2)
+        pairs.add((a, b) if a < b else (b, a))
+    friendships = [{
+        'user_id': a, 'friend_id': b, 'status': 'accepted' if rng.random() < 0.9 else 'pending',
+        'created_at': timestamp()
+    } for a, b in pairs]
+    step('friendships', Friendship.__table__, friendships)
+
+    def invitations():
+        for _ in range(int(args.users * args.pending_invitations)):
+            group_id = rng.randint(1, args.groups)
+            yield {
+                'group_id': group_id, 'user_id': rng.randint(1, args.users),
+                'invited_by': rng.choice(members[group_id]), 'status': 'pending', 'created_at': timestamp()
+            }
+    step('group invitations', GroupInvitation.__table__, invitations())
+
+    # messages go between friends, ids and created_at both increase; older ones are read
+    accepted = [(f['user_id'], f['friend_id']) for f in friendships if f['status'] == 'accepted']
+
+    def messages():
+        for i in range(args.messages):
+            sender, recipient = rng.choice(accepted)
+            if rng.random() < 0.5:
+                sender, recipient = recipient, sender
+            fraction = i / max(1, args.messages)
+            yield {
+                'sender_id': sender, 'recipient_id': recipient,
+                'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))),
+                'read': fraction < 0.95, 'created_at': timestamp(fraction)
+            }
+    if accepted:
+        step('messages', Message.__table__, messages())
+
+    rebuild_derived(log)
+
+
+def rebuild_derived(log=print):
+    # the same rebuilds the maintenance commands in commands.py run
+    from messages_routes import rebuild_conversation_summaries
+    from votes_routes import reconcile_vote_counts
+    from users_routes import rebuild_user_counters
+
+    started = time.perf_counter()
+    summaries = rebuild_conversation_summaries()
+    _, moves = reconcile_vote_counts()
+    users = rebuild_user_counters()
+    log(f"derived tables      {summaries:,} conversation summaries, {moves:,} vote counters, "
+        f"{users:,} badge counters  {time.perf_counter() - started:7.1f}s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ['DATABASE_URL'] = args.database
+
+    from factory import create_app
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        generate(args)
+        print(f"done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
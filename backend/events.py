@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# pub/sub used to push messages, votes and move changes to connected clients.
+# LocalBroker only reaches subscribers in its own process. SQLiteBroker passes events
+# through a small local file that every worker process on the host shares, so a /stream
+# connection sees events published by any worker or by the expiry worker; picked with
+# EVENTS_STORAGE_URL ('memory://' or 'sqlite:///path'), anything with
+# subscribe/unsubscribe/publish can be swapped in with set_broker()
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+def group_channel(group_id):
+    return f'group:{group_id}'
+
+class Subscription:
+    def __init__(self, channels, max_queue):
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def get(self, timeout=None):
+        # returns None when nothing arrived before the timeout
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class LocalBroker:
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channels):
+        sub = Subscription(channels, self.max_queue)
+        with self._lock:
+            for channel in sub.channels:
+                self._subscribers[channel].add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for channel in sub.channels:
+                subs = self._subscribers.get(channel)
+                if subs is None:
+                    continue
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[channel]
+
+    def publish(self, channel, event_type, data):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+
+        event = {'type': event_type, 'channel': channel, 'data': data}
+        for sub in subs:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # slow client, drop the event rather than block the writer
+                pass
+        return len(subs)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._subscribers.values()))
+
+class SQLiteBroker(LocalBroker):
+    # publish() appends to the event table; one thread per process polls it for rows
+    # newer than the last it saw and hands them to this process' subscribers. Events
+    # are only for clients connected right now, hence synchronous=OFF, and rows older
+    # than KEEP_SECONDS are pruned. A stand-in for a shared broker such as Redis
+    PRUNE_EVERY = 1000
+    KEEP_SECONDS = 60
+
+    def __init__(self, path, max_queue=100, poll_interval=0.2):
+        super().__init__(max_queue)
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._published = 0
+        self._poller_pid = None
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS event '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT, type TEXT, data TEXT, stamp REAL)'
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def subscribe(self, channels):
+        # the poller starts with the first subscriber, in the worker rather than in a
+        # gunicorn master that loaded the app before forking
+        with self._lock:
+            if self._poller_pid != os.getpid():
+                self._poller_pid = os.getpid()
+                last_id = self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM event').fetchone()[0]
+                threading.Thread(target=self._poll, args=(last_id,), name='event-poller', daemon=True).start()
+        return super().subscribe(channels)
+
+    def publish(self, channel, event_type, data):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO event (channel, type, data, stamp) VALUES (?, ?, ?, ?)',
+            (channel, event_type, json.dumps(data), now)
+        )
+        self._published += 1
+        if self._published % self.PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM event WHERE stamp < ?', (now - self.KEEP_SECONDS,))
+        # subscribers in other processes aren't known here
+        return None
+
+    def _poll(self, last_id):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                rows = self._connection().execute(
+                    'SELECT id, channel, type, data FROM event WHERE id > ? ORDER BY id', (last_id,)
+                ).fetchall()
+            except sqlite3.Error:
+                logger.exception('error reading events')
+                continue
+            for row_id, channel, event_type, data in rows:
+                super().publish(channel, event_type, json.loads(data))
+                last_id = row_id
+
+def broker_from_url(url):
+    if url in (None, '', 'memory://', 'sqlite://'):
+        return LocalBroker()
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):])
+    raise ValueError(f"unsupported EVENTS_STORAGE_URL: {url}")
+
+_broker = LocalBroker()
+
+def get_broker():
+    return _broker
+
+def set_broker(broker):
+    global _broker
+    _broker = broker
+
+def init_events(app):
+    app.config.setdefault('EVENTS_STORAGE_URL', 'memory://')
+    set_broker(broker_from_url(app.config['EVENTS_STORAGE_URL']))
+
+def publish(channel, event_type, data):
+    return _broker.publish(channel, event_type, data)
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
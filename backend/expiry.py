@@ -0,0 +1,229 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import func
+from models import db, Move, Vote, Group, ExpiryState
+from events import publish, group_channel
+from trending import trending
+from shard_router import fan_out
+
+logger = logging.getLogger(__name__)
+
+# background sweeper for moves whose voting deadline passed without enough votes.
+# deadlines live in the indexed Move.expires_at column, so each run only looks at
+# moves that expired since the previous run and then sleeps until the next deadline.
+# Moves live on their group's shard and groups in the main database, so each shard is
+# swept on its own and group settings are read with a separate IN query.
+#
+# The scheduler may run in the web process or in `flask expiry-worker`, so what the two
+# sides share goes through the ExpiryState row: request_rescan() from a write that can
+# expire moves retroactively, and the stats of the last run
+
+# rows per DELETE ... WHERE id IN (...), stays under SQLite's bound parameter limit
+DELETE_BATCH_SIZE = 500
+
+
+def utcnow():
+    # expires_at is stored as naive UTC, like every other DateTime column in SQLite
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def deadline_for(created_at, vote_deadline_hours):
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return created_at + timedelta(hours=vote_deadline_hours)
+
+
+def refresh_group_deadlines(group):
+    # recompute expires_at after the group's vote_deadline_hours changes, on the
+    # group's shard (already selected)
+    moves = db.session.query(Move.id, Move.created_at).filter(Move.group_id == group.id).all()
+    db.session.bulk_update_mappings(Move, [
+        {'id': move_id, 'expires_at': deadline_for(created_at, group.vote_deadline_hours)}
+        for move_id, created_at in moves
+    ])
+
+
+def _group_settings(column, group_ids):
+    group_ids = set(group_ids)
+    if not group_ids:
+        return {}
+    return dict(db.session.query(Group.id, column).filter(Group.id.in_(group_ids)).all())
+
+
+def backfill_expires_at():
+    # moves created before expires_at existed
+    def backfill():
+        rows = db.session.query(Move.id, Move.created_at, Move.group_id).filter(Move.expires_at.is_(None)).all()
+        hours = _group_settings(Group.vote_deadline_hours, (group_id for _, _, group_id in rows))
+        updates = [
+            {'id': move_id, 'expires_at': deadline_for(created_at, hours[group_id])}
+            for move_id, created_at, group_id in rows if hours.get(group_id) is not None
+        ]
+        if updates:
+            db.session.bulk_update_mappings(Move, updates)
+            db.session.commit()
+        return len(updates)
+    return sum(fan_out(backfill))
+
+
+def sweep_expired_moves(now, expired_after=None):
+    # delete every move past its deadline with fewer votes than its group requires,
+    # returns (moves deleted, votes deleted)
+    most_required = db.session.query(func.max(Group.min_votes_required)).scalar()
+    if most_required is None:
+        return 0, 0
+
+    def sweep():
+        # candidates are narrowed by the largest requirement of any group, then
+        # checked against their own group's
+        query = db.session.query(Move.id, Move.group_id, Move.vote_count).filter(
+            Move.expires_at <= now, Move.vote_count < most_required
+        )
+        if expired_after is not None:
+            query = query.filter(Move.expires_at > expired_after)
+        candidates = query.all()
+        required = _group_settings(Group.min_votes_required, (group_id for _, group_id, _ in candidates))
+        expired = [
+            (move_id, group_id) for move_id, group_id, votes in candidates
+            if required.get(group_id) is not None and votes < required[group_id]
+        ]
+
+        votes_deleted = 0
+        for start in range(0, len(expired), DELETE_BATCH_SIZE):
+            ids = [move_id for move_id, _ in expired[start:start + DELETE_BATCH_SIZE]]
+            votes_deleted += Vote.query.filter(Vote.move_id.in_(ids)).delete(synchronize_session=False)
+            Move.query.filter(Move.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return expired, votes_deleted
+
+    results = fan_out(sweep)
+    expired = [row for shard_expired, _ in results for row in shard_expired]
+    votes_deleted = sum(deleted for _, deleted in results)
+
+    for move_id, group_id in expired:
+        trending.remove_moves(group_id, [move_id])
+        publish(group_channel(group_id), 'move_deleted', {'id': move_id, 'group_id': group_id})
+
+    return len(expired), votes_deleted
+
+
+def request_rescan():
+    # the next run re-checks every move past its deadline, not only those that expired
+    # since the previous run; goes out with the caller's commit. Call scheduler.wake()
+    # afterwards, the worker in another process picks it up within its max_interval
+    ExpiryState.query.filter(ExpiryState.id == 1).update(
+        {ExpiryState.rescan_requests: ExpiryState.rescan_requests + 1}, synchronize_session=False
+    )
+
+
+def _rescan_requests():
+    return db.session.query(ExpiryState.rescan_requests).filter(ExpiryState.id == 1).scalar()
+
+
+def shared_stats():
+    # stats of the last run in whichever process runs the scheduler, None before any
+    stats = db.session.query(ExpiryState.stats).filter(ExpiryState.id == 1).scalar()
+    return json.loads(stats) if stats else None
+
+
+def next_deadline(after):
+    deadlines = [deadline for deadline in fan_out(
+        lambda: db.session.query(func.min(Move.expires_at)).filter(Move.expires_at > after).scalar()
+    ) if deadline is not None]
+    return min(deadlines, default=None)
+
+
+class ExpiryScheduler:
+    def __init__(self, max_interval=60):
+        # upper bound on sleep, so deadlines written by other processes are still picked up
+        self.max_interval = max_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._swept_until = None
+        self._rescans_seen = None
+        self._stats = {
+            'running': False,
+            'runs': 0,
+            'moves_swept_total': 0,
+            'votes_deleted_total': 0,
+            'last_run_at': None,
+            'last_run_seconds': None,
+            'last_swept': 0,
+            'next_deadline': None
+        }
+
+    def run_once(self):
+        now = utcnow()
+        rescans = _rescan_requests()
+        with self._lock:
+            # a rescan requested after this read is seen by the next run
+            expired_after = self._swept_until if rescans == self._rescans_seen else None
+        started = time.perf_counter()
+        moves_swept, votes_deleted = sweep_expired_moves(now, expired_after)
+        upcoming = next_deadline(now)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._swept_until = now
+            self._rescans_seen = rescans
+            self._stats['runs'] += 1
+            self._stats['moves_swept_total'] += moves_swept
+            self._stats['votes_deleted_total'] += votes_deleted
+            self._stats['last_run_at'] = now.isoformat()
+            self._stats['last_run_seconds'] = elapsed
+            self._stats['last_swept'] = moves_swept
+            self._stats['next_deadline'] = upcoming.isoformat() if upcoming else None
+            stats = json.dumps(self._stats)
+        # on a connection of its own: this session's read began before the sweep's commits
+        state = ExpiryState.__table__
+        with db.engine.begin() as conn:
+            conn.execute(state.update().where(state.c.id == 1).values(stats=stats))
+        return upcoming
+
+    def run_forever(self, app):
+        with app.app_context():
+            backfill_expires_at()
+
+        self._stats['running'] = True
+        try:
+            while not self._stop.is_set():
+                timeout = self.max_interval
+                try:
+                    with app.app_context():
+                        upcoming = self.run_once()
+                    if upcoming is not None:
+                        timeout = min(timeout, max(0, (upcoming - utcnow()).total_seconds()))
+                except Exception:
+                    logger.exception('error sweeping expired moves')
+                self._wake.wait(timeout)
+                self._wake.clear()
+        finally:
+            self._stats['running'] = False
+
+    def start(self, app):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, args=(app,), name='move-expiry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        # called after a write that may move the next deadline earlier or requested a
+        # rescan, when the scheduler runs in this process
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+scheduler = ExpiryScheduler()
@@ -0,0 +1,250 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Drives every route against a throwaway SQLite database, captures the SQL each one runs
+# and prints SQLite's EXPLAIN QUERY PLAN for it. Any full table scan, or a route running
+# more queries than its budget (an N+1 loop creeping back in), is reported and makes the
+# script exit with status 1, so it shows up before it ships.
+#
+#   python explain_queries.py [--all]     (--all prints plans that use indexes too)
+#
+# SHARDED_CALLS then replays a few write paths with an extra shard configured, as a
+# check that they still complete when group data is sharded.
+
+_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_db_file.close()
+_archive_file = os.path.splitext(_db_file.name)[0] + '_archive.db'
+os.environ['DATABASE_URL'] = f"sqlite:///{_db_file.name}"
+os.environ['ARCHIVE_DATABASE_URL'] = f"sqlite:///{_archive_file}"
+_ids_file = os.path.splitext(_db_file.name)[0] + '_ids.db'
+os.environ['SHARD_ID_DATABASE_URL'] = f"sqlite:///{_ids_file}"
+os.environ['RATELIMIT_ENABLED'] = '0'
+os.environ['LOAD_SHED_DB_LATENCY_MS'] = '0'
+# statements are captured on the main engine only
+os.environ['SHARD_DATABASE_URLS'] = ''
+
+from sqlalchemy import event
+from app import app
+from config import Config
+from factory import create_app
+from models import db
+from sharding import move_group
+from cache import user_cache, group_cache
+from graph import friend_graph
+from user_search import username_index
+
+# (method, path, json body, query budget) in order; later calls rely on the rows earlier
+# ones create. Listings get at least two rows so a per-row query blows the budget
+ROUTE_CALLS = [
+    ('POST', '/auth/register', {'username': 'alice', 'email': 'alice@example.com', 'password': 'pw'}, None),
+    ('POST', '/auth/register', {'username': 'bob', 'email': 'bob@example.com', 'password': 'pw'}, None),
+    ('POST', '/auth/register', {'username': 'carol', 'email': 'carol@example.com', 'password': 'pw'}, None),
+    ('POST', '/auth/login', {'username': 'alice', 'password': 'pw'}, 1),
+    ('POST', '/friends/request', {'user_id': 1, 'friend_username': 'bob'}, None),
+    ('POST', '/friends/request', {'user_id': 3, 'friend_username': 'bob'}, None),
+    ('GET', '/friends/user/2/requests', None, 2),
+    ('POST', '/friends/accept/1', None, None),
+    ('POST', '/friends/accept/2', None, None),
+    ('GET', '/friends/user/2', None, 2),
+    ('GET', '/friends/profile/2?current_user_id=1', None, 3),
+    ('GET', '/friends/mutual/1?current_user_id=3', None, 1),
+    ('GET', '/friends/suggestions/1', None, 2),
+    ('GET', '/friends/search?q=ca&user_id=1', None, 1),
+    ('POST', '/groups/groups', {'name': 'Weekend Warriors', 'created_by': 1}, None),
+    ('POST', '/groups/groups', {'name': 'Book Club', 'created_by': 1}, None),
+    ('POST', '/groups/join', {'join_key': '<join_key:1>', 'user_id': 2}, None),
+    ('GET', '/groups/user/1/groups', None, 2),
+    ('POST', '/groups/1/add-member', {'user_id': 3, 'added_by': 1}, None),
+    ('POST', '/groups/2/add-member', {'user_id': 3, 'added_by': 1}, None),
+    ('GET', '/groups/user/3/invitations', None, 3),
+    ('POST', '/groups/2/invitations/batch', {'user_ids': [2, 3, 99], 'added_by': 1}, 6),
+    ('POST', '/groups/invitations/1/accept', None, None),
+    ('POST', '/groups/invitations/2/decline', None, None),
+    ('GET', '/groups/1/member-count', None, 1),
+    ('GET', '/groups/1/settings', None, 1),
+    ('PUT', '/groups/1/settings', {'user_id': 1, 'min_votes_required': 2, 'vote_deadline_hours': 48}, None),
+    ('POST', '/api/groups/1/moves', {'name': 'Pizza Night', 'description': 'Order pizza', 'created_by': 1}, None),
+    ('POST', '/api/groups/1/moves', {'name': 'Hiking Trip', 'description': 'Morning hike', 'created_by': 2}, None),
+    ('GET', '/api/groups/1/moves', None, 2),
+    ('GET', '/api/groups/1/moves?sort=trending&limit=5', None, 3),
+    ('PUT', '/api/moves/1', {'name': 'Pizza and Movies'}, None),
+    ('POST', '/votes/move/1/vote', {'user_id': 1}, None),
+    ('POST', '/votes/move/1/vote', {'user_id': 2}, None),
+    ('POST', '/votes/move/2/vote', {'user_id': 1}, None),
+    ('POST', '/votes/move/2/vote', {'user_id': 1}, None),
+    ('GET', '/votes/move/1', None, 2),
+    ('GET', '/api/groups/1/moves?sort=trending&limit=5', None, 2),
+    ('GET', '/votes/group/1', None, 2),
+    ('GET', '/groups/1/board', None, 3),
+    ('POST', '/groups/1/cleanup-moves', None, None),
+    ('DELETE', '/api/moves/2', None, None),
+    ('POST', '/messages/send', {'sender_id': 1, 'recipient_id': 2, 'content': 'hey'}, None),
+    ('POST', '/messages/send', {'sender_id': 2, 'recipient_id': 1, 'content': 'hi!'}, None),
+    ('POST', '/messages/send', {'sender_id': 3, 'recipient_id': 1, 'content': 'yo'}, None),
+    ('GET', '/messages/conversation/1/2', None, None),
+    ('GET', '/messages/conversation/1/2?after_id=1', None, 2),
+    ('GET', '/messages/conversation/1/2?before_id=2&limit=1', None, 2),
+    ('GET', '/messages/user/1/conversations', None, 2),
+    ('GET', '/messages/user/1/search?q=he', None, 3),
+    ('GET', '/api/groups/1/moves/search?q=pizza&limit=5', None, 3),
+    ('GET', '/user/1/badges', None, 1),
+    ('GET', '/user/2/badges', None, 1),
+    ('DELETE', '/friends/remove/1', None, None),
+]
+
+# (method, path, json body, expected status) against a fresh database with one extra
+# shard and the group kept on shard 0, the main database. These requests write the
+# main database and then insert a sharded row that needs an allocated id: a toggle
+# whose DELETE finds no vote still holds the main write lock when the new vote is
+# flushed, and accepting an invitation adds a member next to the badge counter update
+SHARDED_CALLS = [
+    ('POST', '/auth/register', {'username': 'alice', 'email': 'alice@example.com', 'password': 'pw'}, 201),
+    ('POST', '/auth/register', {'username': 'bob', 'email': 'bob@example.com', 'password': 'pw'}, 201),
+    ('POST', '/groups/groups', {'name': 'Shard Zero', 'created_by': 1}, 201),
+    ('POST', '/api/groups/1/moves', {'name': 'Pizza Night', 'created_by': 1}, 201),
+    ('POST', '/votes/move/1/vote', {'user_id': 2}, 200),
+    ('POST', '/votes/move/1/vote', {'user_id': 2}, 200),
+    ('POST', '/votes/move/1/vote', {'user_id': 2}, 200),
+    ('POST', '/groups/1/add-member', {'user_id': 2, 'added_by': 1}, 201),
+    ('POST', '/groups/invitations/1/accept', None, 200),
+]
+
+
+def is_scan(detail):
+    # "SCAN move" / "SCAN TABLE move" (older SQLite) read every row of a table;
+    # constant rows and subquery co-routines (e.g. an empty IN list) are not table scans
+    if not detail.startswith('SCAN'):
+        return False
+    target = detail[len('SCAN '):]
+    if target.startswith('TABLE '):
+        target = target[len('TABLE '):]
+    # an FTS5 MATCH shows up as "SCAN <fts table> VIRTUAL TABLE INDEX n:M..." but reads
+    # only the matching rows from the full-text index
+    if 'VIRTUAL TABLE INDEX' in target:
+        return False
+    return not target.startswith(('(', 'CONSTANT ROW', 'SUBQUERY'))
+
+
+def capture_route_queries():
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            captured.append((statement, parameters))
+
+    with app.app_context():
+        # the friend graph and username index are loaded once per process with whole-table
+        # reads; load them up front (empty) so routes only show their own queries, writes
+        # keep them current
+        friend_graph.load()
+        username_index.load()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    client = app.test_client()
+    join_keys = {}
+    results = []
+    for method, path, body, budget in ROUTE_CALLS:
+        if body and isinstance(body.get('join_key'), str) and body['join_key'].startswith('<join_key:'):
+            body = dict(body, join_key=join_keys[int(body['join_key'][10:-1])])
+        # start cold so the identity cache can't hide a per-row query
+        user_cache.clear()
+        group_cache.clear()
+        del captured[:]
+        response = client.open(path, method=method, json=body)
+        if path == '/groups/groups' and response.status_code == 201:
+            join_keys[response.json['id']] = response.json['join_key']
+        results.append((f"{method} {path}", response.status_code, budget, list(captured)))
+
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return results
+
+
+def check_sharded_writes():
+    # returns the number of SHARDED_CALLS that didn't answer as expected
+    directory = tempfile.mkdtemp()
+
+    class ShardedConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{directory}/main.db"
+        SHARD_DATABASE_URLS = [f"sqlite:///{directory}/shard1.db"]
+        SQLALCHEMY_BINDS = {
+            'archive': f"sqlite:///{directory}/archive.db",
+            'ids': f"sqlite:///{directory}/ids.db",
+            'shard1': SHARD_DATABASE_URLS[0],
+        }
+        # a request stuck behind a lock fails fast instead of after the usual 5s
+        SQLITE_BUSY_TIMEOUT_MS = 1000
+
+    sharded = create_app(ShardedConfig)
+    client = sharded.test_client()
+    failures = 0
+    try:
+        for method, path, body, expected in SHARDED_CALLS:
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"{method} {path}  -> {response.status_code}  ({elapsed:.0f} ms)")
+            if response.status_code != expected:
+                failures += 1
+                print(f"    !! expected {expected}")
+            if path == '/groups/groups' and response.status_code == 201:
+                # new groups land on a random shard
+                with sharded.app_context():
+                    move_group(response.json['id'], 0, settle=0)
+    finally:
+        with sharded.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        shutil.rmtree(directory, ignore_errors=True)
+    return failures
+
+
+def explain(statement, parameters):
+    with app.app_context():
+        with db.engine.connect() as conn:
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def main(show_all=False):
+    scans = 0
+    over_budget = 0
+    for label, status, budget, statements in capture_route_queries():
+        print(f"{label}  -> {status}  ({len(statements)} queries)")
+        if budget is not None and len(statements) > budget:
+            over_budget += 1
+            print(f"    !! over query budget: {len(statements)} > {budget}")
+        for statement, parameters in statements:
+            plan = explain(statement, parameters)
+            route_scans = [detail for detail in plan if is_scan(detail)]
+            scans += len(route_scans)
+            if route_scans or show_all:
+                print(f"    {' '.join(statement.split())}")
+                for detail in plan:
+                    marker = '!!' if is_scan(detail) else '  '
+                    print(f"      {marker} {detail}")
+    print()
+    print("with an extra shard:")
+    sharded_failures = check_sharded_writes()
+    print()
+    print(f"{scans} full table scan(s) found")
+    print(f"{over_budget} route(s) over their query budget")
+    print(f"{sharded_failures} sharded write(s) failed")
+    return 1 if scans or over_budget or sharded_failures else 0
+
+
+if __name__ == '__main__':
+    try:
+        status = main(show_all='--all' in sys.argv)
+    finally:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        os.unlink(_db_file.name)
+        for path in (_archive_file, _ids_file):
+            if os.path.exists(path):
+                os.unlink(path)
+    sys.exit(status)
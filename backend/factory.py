@@ -0,0 +1,150 @@
+from flask import Flask, jsonify
+from flask_cors import CORS
+from sqlalchemy import event
+from models import db
+from routes import api
+from auth import auth
+from groups_routes import groups_bp
+from friends_routes import friends_bp
+from messages_routes import messages_bp
+from votes_routes import votes_bp
+from stream_routes import stream_bp
+from users_routes import users_bp
+from commands import register_commands
+from migrations import upgrade
+from cache import user_cache, group_cache
+from config import Config
+from metrics import init_metrics, register_collector
+from profiling import init_profiling
+from ratelimit import init_ratelimit, db_latency, rejected
+from sharding import init_sharding
+from logs import init_logging, NonBlockingQueueHandler
+from serialization import init_serialization
+from graph import friend_graph
+from user_search import username_index
+from trending import trending
+from events import get_broker, init_events
+from expiry import scheduler
+from archive import archiver
+
+def create_app(config_object=Config):
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+
+    origins = app.config['CORS_ORIGINS']
+    CORS(app, resources={
+        r"/api/*": {"origins": origins, "methods": ["GET", "POST", "PUT", "DELETE"]},
+        r"/auth/*": {"origins": origins, "methods": ["GET", "POST"]},
+        r"/groups/*": {"origins": origins, "methods": ["GET", "POST", "PUT", "DELETE"]},
+        r"/friends/*": {"origins": origins, "methods": ["GET", "POST", "DELETE"]},
+        r"/messages/*": {"origins": origins, "methods": ["GET", "POST"]},
+        r"/votes/*": {"origins": origins, "methods": ["GET", "POST"]},
+        r"/stream/*": {"origins": origins, "methods": ["GET"]},
+        r"/user/*": {"origins": origins, "methods": ["GET"]}
+    })
+
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', _engine_options(app.config))
+
+    init_logging(app)
+    init_serialization(app)
+    db.init_app(app)
+    init_sharding(app)
+    init_metrics(app, db)
+    init_profiling(app)
+    init_ratelimit(app, db)
+    init_events(app)
+    app.register_blueprint(api, url_prefix='/api')
+    app.register_blueprint(auth, url_prefix='/auth')
+    app.register_blueprint(groups_bp, url_prefix='/groups')
+    app.register_blueprint(friends_bp, url_prefix='/friends')
+    app.register_blueprint(messages_bp, url_prefix='/messages')
+    app.register_blueprint(votes_bp, url_prefix='/votes')
+    app.register_blueprint(stream_bp, url_prefix='/stream')
+    app.register_blueprint(users_bp, url_prefix='/user')
+    register_commands(app)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _sqlite_pragmas(app.config))
+        upgrade()
+
+    @app.route('/')
+    def home():
+        return jsonify({"message": "Welcome to Moves API"})
+
+    @app.route('/cache/stats')
+    def cache_stats():
+        return jsonify({"users": user_cache.stats(), "groups": group_cache.stats()})
+
+    return app
+
+def _collect_runtime_gauges():
+    caches = {'users': user_cache.stats(), 'groups': group_cache.stats()}
+    expiry = scheduler.stats()
+    return [
+        ('moves_cache_entries', 'Entries in the identity cache.',
+         {(name,): s['size'] for name, s in caches.items()}, ('cache',)),
+        ('moves_cache_hits', 'Identity cache hits since start.',
+         {(name,): s['hits'] for name, s in caches.items()}, ('cache',)),
+        ('moves_cache_misses', 'Identity cache misses since start.',
+         {(name,): s['misses'] for name, s in caches.items()}, ('cache',)),
+        ('moves_expiry_moves_swept', 'Expired moves deleted by this process\' scheduler.',
+         {(): expiry['moves_swept_total']}, ()),
+        ('moves_expiry_runs', 'Expiry scheduler runs in this process.',
+         {(): expiry['runs']}, ()),
+        ('moves_archive_messages_archived', 'Messages moved to the archive by this process.',
+         {(): archiver.stats()['messages_archived_total']}, ()),
+        ('moves_stream_subscribers', 'Open /stream connections.',
+         {(): get_broker().subscriber_count()}, ()),
+        ('moves_friend_graph_users', 'Users in the in-memory friend graph.',
+         {(): friend_graph.stats()['users']}, ()),
+        ('moves_username_index_users', 'Users in the in-memory username index.',
+         {(): username_index.stats()['users']}, ()),
+        ('moves_trending_groups', 'Groups with a loaded trending ranking.',
+         {(): trending.stats()['groups']}, ()),
+        ('moves_requests_rejected', 'Requests refused by rate limits or load shedding since start.',
+         {(reason,): count for reason, count in rejected.items()}, ('reason',)),
+        ('moves_db_statement_latency_ms', 'Decaying average SQL statement time used for load shedding.',
+         {(): db_latency.current_ms()}, ()),
+        ('moves_log_records_dropped', 'Log records dropped because the log queue was full.',
+         {(): NonBlockingQueueHandler.dropped}, ()),
+    ]
+
+register_collector(_collect_runtime_gauges)
+
+def _is_sqlite_memory(uri):
+    return uri.startswith('sqlite') and (':memory:' in uri or uri.rstrip('/') in ('sqlite:', 'sqlite://'))
+
+def _engine_options(config):
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if _is_sqlite_memory(uri):
+        # in-memory databases live in a single connection, leave Flask-SQLAlchemy's pool alone
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    if uri.startswith('sqlite'):
+        # pooled connections move between request threads; the driver-level timeout
+        # matches busy_timeout so both layers wait the same amount for the write lock
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000
+        }
+    else:
+        options['pool_pre_ping'] = True
+    return options
+
+def _sqlite_pragmas(config):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if config['SQLITE_JOURNAL_MODE']:
+            cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        if config['SQLITE_SYNCHRONOUS']:
+            cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.close()
+    return set_pragmas
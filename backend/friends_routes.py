@@ -1,5 +1,11 @@
-from flask import Blueprint, request, jsonify
-from models import db, Friendship, User, GroupMember, Group
+from flask import Blueprint, request, jsonify, abort
+from models import db, Friendship, User, GroupMember
+from loaders import user_dicts, user_dict, group_dicts
+from serialization import projected
+from graph import friend_graph
+from user_search import username_index
+from users_routes import bump_counter
+from shard_router import fan_out
 
 friends_bp = Blueprint('friends', __name__)
 
@@ -35,10 +41,40 @@ def send_friend_request():
     )
 
     db.session.add(friendship)
+    bump_counter([friend.id], 'pending_friend_requests', 1)
     db.session.commit()
 
     return jsonify({"message": "Friend request sent"}), 201
 
+# username typeahead: prefix matches (the searching user's friends, then people in their
+# groups, then everyone else) and fuzzy matches for typos
+@friends_bp.route('/search', methods=['GET'])
+def search_users():
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    user_id = request.args.get('user_id', type=int)
+
+    related = {}
+    if user_id:
+        for group_id in friend_graph.groups_of(user_id):
+            for member_id in friend_graph.members.get(group_id, ()):
+                related[member_id] = 1
+        for friend_id in friend_graph.friends_of(user_id):
+            related[friend_id] = 0
+        related.pop(user_id, None)
+
+    matches = [(uid, match) for uid, match in username_index.search(query, limit + 1, related)
+               if uid != user_id][:limit]
+    users = user_dicts(uid for uid, _ in matches)
+    results = []
+    for uid, match in matches:
+        user = users.get(uid)
+        if user:
+            results.append(dict(user, match=match, relation=(
+                'friend' if related.get(uid) == 0 else 'group' if uid in related else None
+            )))
+    return jsonify(projected(results))
+
 @friends_bp.route('/user/<int:user_id>', methods=['GET'])
 def get_friends(user_id):
     # get accepted friendships
@@ -47,44 +83,58 @@ def get_friends(user_id):
         (Friendship.status == 'accepted')
     ).all()
 
+    friend_ids = [f.friend_id if f.user_id == user_id else f.user_id for f in friendships]
+    users = user_dicts(friend_ids)
+
     friends = []
-    for friendship in friendships:
-        friend_id = friendship.friend_id if friendship.user_id == user_id else friendship.user_id
-        friend = User.query.get(friend_id)
+    for friend_id in friend_ids:
+        friend = users.get(friend_id)
         if friend:
-            friends.append(friend.to_dict())
+            friends.append(friend)
 
-    return jsonify(friends)
+    return jsonify(projected(friends))
 
 @friends_bp.route('/user/<int:user_id>/requests', methods=['GET'])
 def get_friend_requests(user_id):
     # get pending requests where user is the recipient
     requests = Friendship.query.filter_by(friend_id=user_id, status='pending').all()
 
+    senders = user_dicts(req.user_id for req in requests)
+
     request_list = []
     for req in requests:
-        sender = User.query.get(req.user_id)
+        sender = senders.get(req.user_id)
         if sender:
             request_list.append({
                 'id': req.id,
-                'user': sender.to_dict(),
+                'user': sender,
                 'created_at': req.created_at.isoformat()
             })
-    return jsonify(request_list)
+    return jsonify(projected(request_list))
 
 @friends_bp.route('/accept/<int:friendship_id>', methods=['POST'])
 def accept_friend_request(friendship_id):
     friendship = Friendship.query.get_or_404(friendship_id)
+    was_pending = friendship.status == 'pending'
     friendship.status = 'accepted'
+    user_id, friend_id = friendship.user_id, friendship.friend_id
+    if was_pending:
+        bump_counter([friend_id], 'pending_friend_requests', -1)
     db.session.commit()
+    friend_graph.add_friendship(user_id, friend_id)
 
     return jsonify({"message": "Friend request accepted"})
 
 @friends_bp.route('/remove/<int:friendship_id>', methods=['DELETE'])
 def remove_friend(friendship_id):
     friendship = Friendship.query.get_or_404(friendship_id)
+    user_id, friend_id = friendship.user_id, friendship.friend_id
+    was_pending = friendship.status == 'pending'
     db.session.delete(friendship)
+    if was_pending:
+        bump_counter([friend_id], 'pending_friend_requests', -1)
     db.session.commit()
+    friend_graph.remove_friendship(user_id, friend_id)
     
     return jsonify({"message": "Friendship removed"})
 
@@ -93,7 +143,9 @@ def get_user_profile(user_id):
     # get user profile information
     current_user_id = request.args.get('current_user_id', type=int)
 
-    user = User.query.get_or_404(user_id)
+    user = user_dict(user_id)
+    if user is None:
+        abort(404)
 
     # count the number of friends
     friend_count = Friendship.query.filter(
@@ -101,26 +153,58 @@ def get_user_profile(user_id):
         (Friendship.status == 'accepted')
     ).count()
 
-    # count the number of groups
-    group_count = GroupMember.query.filter_by(user_id=user_id).count()
+    # count the number of groups, memberships are spread over the shards
+    group_count = sum(fan_out(lambda: GroupMember.query.filter_by(user_id=user_id).count()))
 
-    # get mutual groups if current_user_id provided
+    # get mutual groups and friends if current_user_id provided
     mutual_groups = []
+    mutual_friend_count = 0
     if current_user_id:
-        user_groups = GroupMember.query.filter_by(user_id = user_id).all()
-        current_user_groups = GroupMember.query.filter_by(user_id=current_user_id).all()
-
-        user_group_ids = [g.group_id for g in user_groups]
-        current_user_group_ids = [g.group_id for g in current_user_groups]
-
-        mutual_group_ids = set(user_group_ids).intersection(set(current_user_group_ids))
-        mutual_groups = Group.query.filter(Group.id.in_(mutual_group_ids)).all()
-        mutual_groups = [g.to_dict() for g in mutual_groups]
+        groups = group_dicts(friend_graph.mutual_groups(user_id, current_user_id))
+        mutual_groups = [groups[gid] for gid in sorted(groups)]
+        mutual_friend_count = len(friend_graph.mutual_friends(user_id, current_user_id))
 
     return jsonify({
-        'user': user.to_dict(),
+        'user': user,
         'friend_count': friend_count,
         'group_count': group_count,
-        'mutual_groups': mutual_groups
+        'mutual_groups': mutual_groups,
+        'mutual_friend_count': mutual_friend_count
     })
 
+# friends both users have
+@friends_bp.route('/mutual/<int:user_id>', methods=['GET'])
+def get_mutual_friends(user_id):
+    current_user_id = request.args.get('current_user_id', type=int)
+    if current_user_id is None:
+        return jsonify({"error": "current_user_id is required"}), 400
+
+    mutual_ids = friend_graph.mutual_friends(user_id, current_user_id)
+    users = user_dicts(mutual_ids)
+    return jsonify(projected([users[uid] for uid in mutual_ids if uid in users]))
+
+# people you may know: friends of friends and group co-members, most mutual friends first
+@friends_bp.route('/suggestions/<int:user_id>', methods=['GET'])
+def get_friend_suggestions(user_id):
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+
+    # pending requests either way aren't suggestions either
+    pending = Friendship.query.filter(
+        ((Friendship.user_id == user_id) | (Friendship.friend_id == user_id)) &
+        (Friendship.status == 'pending')
+    ).all()
+    exclude = {f.friend_id if f.user_id == user_id else f.user_id for f in pending}
+
+    suggestions = friend_graph.suggestions(user_id, limit, exclude)
+    users = user_dicts(s['user_id'] for s in suggestions)
+    result = []
+    for s in suggestions:
+        user = users.get(s['user_id'])
+        if user:
+            result.append({
+                'user': user,
+                'mutual_friends': s['mutual_friends'],
+                'mutual_groups': s['mutual_groups']
+            })
+    return jsonify(projected(result))
+
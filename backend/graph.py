@@ -0,0 +1,176 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from models import db, Friendship, GroupMember
+from shard_router import fan_out
+
+# in-memory adjacency index of accepted friendships and group memberships, one sorted
+# int array per user (and per group for members). Mutual friends / groups are sorted
+# array intersections and suggestions walk friends-of-friends, all without touching the
+# database. Writes in this process update the index right after they commit; every
+# process also reloads it once it is older than max_age, which bounds how stale
+# another worker's writes can look (same trade-off as cache.py)
+
+
+def _intersect(a, b):
+    # walk the shorter array and binary search the longer one
+    if len(a) > len(b):
+        a, b = b, a
+    result = []
+    n = len(b)
+    for value in a:
+        i = bisect_left(b, value)
+        if i < n and b[i] == value:
+            result.append(value)
+    return result
+
+
+def _add(index, key, value):
+    values = index.get(key)
+    if values is None:
+        index[key] = array('l', [value])
+        return
+    i = bisect_left(values, value)
+    if i == len(values) or values[i] != value:
+        values.insert(i, value)
+
+
+def _remove(index, key, value):
+    values = index.get(key)
+    if values is None:
+        return
+    i = bisect_left(values, value)
+    if i < len(values) and values[i] == value:
+        del values[i]
+
+
+def _freeze(lists):
+    return {key: array('l', sorted(set(values))) for key, values in lists.items()}
+
+
+class FriendGraph:
+    EMPTY = array('l')
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.friends = {}
+        self.groups = {}
+        self.members = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+
+    def load(self):
+        # two indexed reads (memberships on every shard), built into new dicts and swapped in so readers never see
+        # a half-built index
+        friends = defaultdict(list)
+        for user_id, friend_id in db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+            Friendship.status == 'accepted'
+        ):
+            friends[user_id].append(friend_id)
+            friends[friend_id].append(user_id)
+        groups = defaultdict(list)
+        members = defaultdict(list)
+        # memberships from every shard; a set, since a group being moved is briefly on two
+        memberships = set()
+        for rows in fan_out(lambda: db.session.query(GroupMember.group_id, GroupMember.user_id).all()):
+            memberships.update(rows)
+        for group_id, user_id in memberships:
+            groups[user_id].append(group_id)
+            members[group_id].append(user_id)
+        with self._lock:
+            self.friends = _freeze(friends)
+            self.groups = _freeze(groups)
+            self.members = _freeze(members)
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at <= self.max_age:
+            return
+        # one thread reloads, the others keep answering from the current index
+        # (they only wait when there is no index yet)
+        if self._loading.acquire(blocking=self.loaded_at is None):
+            try:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age:
+                    self.load()
+            finally:
+                self._loading.release()
+
+    # incremental updates, no-ops until the index is first loaded
+
+    def add_friendship(self, user_id, friend_id):
+        if self.loaded_at is None:
+            return
+        with self._lock:
+            _add(self.friends, user_id, friend_id)
+            _add(self.friends, friend_id, user_id)
+
+    def remove_friendship(self, user_id, friend_id):
+        if self.loaded_at is None:
+            return
+        with self._lock:
+            _remove(self.friends, user_id, friend_id)
+            _remove(self.friends, friend_id, user_id)
+
+    def add_member(self, group_id, user_id):
+        if self.loaded_at is None:
+            return
+        with self._lock:
+            _add(self.groups, user_id, group_id)
+            _add(self.members, group_id, user_id)
+
+    # queries
+
+    def friends_of(self, user_id):
+        self.ensure_loaded()
+        return self.friends.get(user_id, self.EMPTY)
+
+    def groups_of(self, user_id):
+        self.ensure_loaded()
+        return self.groups.get(user_id, self.EMPTY)
+
+    def mutual_friends(self, user_id, other_id):
+        return _intersect(self.friends_of(user_id), self.friends_of(other_id))
+
+    def mutual_groups(self, user_id, other_id):
+        return _intersect(self.groups_of(user_id), self.groups_of(other_id))
+
+    def suggestions(self, user_id, limit=10, exclude=()):
+        # people the user isn't friends with, ranked by mutual friends, then by groups
+        # they share; co-members of the user's groups count even with no mutual friend
+        friends = self.friends_of(user_id)
+        skip = set(friends)
+        skip.add(user_id)
+        skip.update(exclude)
+
+        mutual_friends = defaultdict(int)
+        for friend_id in friends:
+            for candidate in self.friends.get(friend_id, self.EMPTY):
+                if candidate not in skip:
+                    mutual_friends[candidate] += 1
+        shared_groups = defaultdict(int)
+        for group_id in self.groups_of(user_id):
+            for candidate in self.members.get(group_id, self.EMPTY):
+                if candidate not in skip:
+                    shared_groups[candidate] += 1
+
+        candidates = set(mutual_friends) | set(shared_groups)
+        ranked = heapq.nsmallest(limit, candidates, key=lambda c: (-mutual_friends[c], -shared_groups[c], c))
+        return [
+            {'user_id': c, 'mutual_friends': mutual_friends[c], 'mutual_groups': shared_groups[c]}
+            for c in ranked
+        ]
+
+    def stats(self):
+        return {
+            'users': len(self.friends),
+            'friendships': sum(len(v) for v in self.friends.values()) // 2,
+            'memberships': sum(len(v) for v in self.members.values()),
+            'age_seconds': time.monotonic() - self.loaded_at if self.loaded_at is not None else None
+        }
+
+
+friend_graph = FriendGraph()
@@ -1,16 +1,30 @@
-from flask import Blueprint, request, jsonify
-from models import db, Group, GroupMember, User, GroupInvitation
+from flask import Blueprint, request, jsonify, abort
+from datetime import datetime, timezone
+import hashlib
+import json
+from models import db, Group, GroupMember, User, GroupInvitation, Move
+from routes import move_with_deadline
+from votes_routes import group_votes_summary
+from expiry import scheduler, refresh_group_deadlines, request_rescan, shared_stats
+from loaders import user_dicts, group_dicts, group_dict, member_group_ids
+from cache import group_cache
+from serialization import projected
+from graph import friend_graph
+from users_routes import bump_counter
+from trending import trending
+from sharding import use_group, use_group_of, place_group, assign_ids
+from shard_router import fan_out
 import secrets;
 
 groups_bp = Blueprint('groups', __name__)
 
+MAX_BATCH_INVITATIONS = 200
+
 # get all groups for a user
 @groups_bp.route('/user/<int:user_id>/groups', methods=['GET'])
 def get_user_groups(user_id):
-    memberships = GroupMember.query.filter_by(user_id=user_id).all()
-    group_ids = [m.group_id for m in memberships]
-    groups = Group.query.filter(Group.id.in_(group_ids)).all()
-    return jsonify([group.to_dict() for group in groups])
+    groups = group_dicts(member_group_ids(user_id))
+    return jsonify(projected([groups[group_id] for group_id in sorted(groups)]))
 
 # create a new group
 @groups_bp.route('/groups', methods=['POST'])
@@ -23,10 +37,13 @@ def create_group():
     new_group = Group(
         name=data['name'],
         created_by=data['created_by'],
-        join_key=join_key
+        join_key=join_key,
+        shard=place_group()
     )
     db.session.add(new_group)
     db.session.commit()
+    group_cache.invalidate(new_group.id)
+    use_group(new_group)
     
     # automatically add creator as a member
     membership = GroupMember(
@@ -35,6 +52,7 @@ def create_group():
     )
     db.session.add(membership)
     db.session.commit()
+    friend_graph.add_member(new_group.id, data['created_by'])
     
     return jsonify(new_group.to_dict()), 201
 
@@ -48,6 +66,7 @@ def join_group_by_key():
 
     if not group:
         return jsonify({"error": "Invalid join key"}), 404
+    use_group(group)
     
     # check if already a member
     existing = GroupMember.query.filter_by(
@@ -64,6 +83,7 @@ def join_group_by_key():
     )
     db.session.add(membership)
     db.session.commit()
+    friend_graph.add_member(group.id, data['user_id'])
     
     return jsonify({"message": "Joined group successfully", "group": group.to_dict()}), 200
 
@@ -76,6 +96,7 @@ def send_group_invitation(group_id):
     
     # Check if group exists
     group = Group.query.get_or_404(group_id)
+    use_group(group)
     
     # Check if the person inviting is a member
     is_member = GroupMember.query.filter_by(
@@ -114,31 +135,102 @@ def send_group_invitation(group_id):
     )
     
     db.session.add(invitation)
+    bump_counter([user_id], 'pending_group_invitations', 1)
     db.session.commit()
     
     return jsonify({"message": "Group invitation sent successfully"}), 201
 
+# invite several users at once, e.g. a whole friend list; each user gets a status:
+# invited, already_member, already_invited or not_found
+@groups_bp.route('/<int:group_id>/invitations/batch', methods=['POST'])
+def send_group_invitations_batch(group_id):
+    data = request.json
+    invited_by = data.get('added_by')
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list) or not all(isinstance(u, int) for u in user_ids):
+        return jsonify({"error": "user_ids must be a list of user ids"}), 400
+    if len(user_ids) > MAX_BATCH_INVITATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_INVITATIONS} users per batch"}), 400
+    user_ids = list(dict.fromkeys(user_ids))
+
+    # the group is in the main database, its members on its shard
+    group = Group.query.get_or_404(group_id)
+    use_group(group)
+    is_member = db.session.query(GroupMember.id).filter(
+        GroupMember.group_id == group_id, GroupMember.user_id == invited_by
+    ).first()
+    if is_member is None:
+        return jsonify({"error": "You must be a member to invite others"}), 403
+
+    existing = set()
+    members = set()
+    pending = set()
+    if user_ids:
+        existing = {u for (u,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+        members = {u for (u,) in db.session.query(GroupMember.user_id).filter(
+            GroupMember.group_id == group_id, GroupMember.user_id.in_(user_ids)
+        )}
+        pending = {u for (u,) in db.session.query(GroupInvitation.user_id).filter(
+            GroupInvitation.group_id == group_id,
+            GroupInvitation.user_id.in_(user_ids),
+            GroupInvitation.status == 'pending'
+        )}
+
+    results = []
+    invitations = []
+    for user_id in user_ids:
+        if user_id not in existing:
+            status = 'not_found'
+        elif user_id in members:
+            status = 'already_member'
+        elif user_id in pending:
+            status = 'already_invited'
+        else:
+            status = 'invited'
+            invitations.append({
+                'group_id': group_id, 'user_id': user_id, 'invited_by': invited_by, 'status': 'pending'
+            })
+        results.append({"user_id": user_id, "status": status})
+
+    if invitations:
+        db.session.execute(GroupInvitation.__table__.insert(), assign_ids(GroupInvitation.__table__, invitations))
+        bump_counter((i['user_id'] for i in invitations), 'pending_group_invitations', 1)
+        db.session.commit()
+
+    return jsonify({"invited": len(invitations), "results": results}), 201 if invitations else 200
+
 # get pending group invitations for a user
 @groups_bp.route('/user/<int:user_id>/invitations', methods=['GET'])
 def get_group_invitations(user_id):
-    invitations = GroupInvitation.query.filter_by(user_id=user_id, status='pending').all()
-    
+    # from every shard, deduplicated in case a group is mid-move
+    invitations = {}
+    for rows in fan_out(lambda: GroupInvitation.query.filter_by(user_id=user_id, status='pending').all()):
+        invitations.update((invite.id, invite) for invite in rows)
+    invitations = [invitations[invitation_id] for invitation_id in sorted(invitations)]
+    
+    groups = group_dicts(invite.group_id for invite in invitations)
+    inviters = user_dicts(invite.invited_by for invite in invitations)
+
     invite_list = []
     for invite in invitations:
-        group = Group.query.get(invite.group_id)
-        inviter = User.query.get(invite.invited_by)
+        group = groups.get(invite.group_id)
+        inviter = inviters.get(invite.invited_by)
+        if not group or not inviter:
+            continue
         invite_list.append({
             'id': invite.id,
-            'group': group.to_dict(),
-            'invited_by': inviter.to_dict(),
+            'group': group,
+            'invited_by': inviter,
             'created_at': invite.created_at.isoformat()
         })
     
-    return jsonify(invite_list)
+    return jsonify(projected(invite_list))
 
 # accept group invitation
 @groups_bp.route('/invitations/<int:invitation_id>/accept', methods=['POST'])
 def accept_group_invitation(invitation_id):
+    if not use_group_of(GroupInvitation, invitation_id):
+        abort(404)
     invitation = GroupInvitation.query.get_or_404(invitation_id)
     
     # Add user to group
@@ -148,16 +240,26 @@ def accept_group_invitation(invitation_id):
     )
     
     db.session.add(new_member)
+    was_pending = invitation.status == 'pending'
     invitation.status = 'accepted'
+    group_id, user_id = invitation.group_id, invitation.user_id
+    if was_pending:
+        bump_counter([user_id], 'pending_group_invitations', -1)
     db.session.commit()
+    friend_graph.add_member(group_id, user_id)
     
     return jsonify({"message": "Group invitation accepted"}), 200
 
 # decline group invitation
 @groups_bp.route('/invitations/<int:invitation_id>/decline', methods=['POST'])
 def decline_group_invitation(invitation_id):
+    if not use_group_of(GroupInvitation, invitation_id):
+        abort(404)
     invitation = GroupInvitation.query.get_or_404(invitation_id)
+    was_pending = invitation.status == 'pending'
     invitation.status = 'declined'
+    if was_pending:
+        bump_counter([invitation.user_id], 'pending_group_invitations', -1)
     db.session.commit()
     
     return jsonify({"message": "Group invitation declined"}), 200 
@@ -165,8 +267,39 @@ def decline_group_invitation(invitation_id):
 # get group settings (only for group leader)
 @groups_bp.route('/<int:group_id>/settings', methods=['GET'])
 def get_group_settings(group_id):
+    group = group_dict(group_id)
+    if group is None:
+        abort(404)
+    return jsonify(group)
+
+# everything the moves board needs in one response: settings, moves with deadlines and votes
+# built from three queries (group, moves, one join for votes) and served with an ETag
+@groups_bp.route('/<int:group_id>/board', methods=['GET'])
+def get_group_board(group_id):
     group = Group.query.get_or_404(group_id)
-    return jsonify(group.to_dict())
+    use_group(group)
+    moves = Move.query.filter_by(group_id=group_id).order_by(Move.id).all()
+    votes = group_votes_summary(group_id, moves)
+
+    now = datetime.now(timezone.utc)
+    board = {
+        'settings': group.to_dict(),
+        'moves': [move_with_deadline(move, group, now) for move in moves],
+        'votes': votes
+    }
+
+    # the countdown fields change every second, leave them out of the ETag so an
+    # unchanged board still revalidates (clients count down from 'deadline')
+    stable = dict(board, moves=[
+        {k: v for k, v in m.items() if k not in ('time_remaining_seconds', 'is_expired')}
+        for m in board['moves']
+    ])
+    etag = hashlib.sha1(json.dumps(stable, sort_keys=True).encode()).hexdigest()
+
+    response = jsonify(board)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 # update group settings (only for group leader)
 @groups_bp.route('/<int:group_id>/settings', methods=['PUT'])
@@ -185,47 +318,35 @@ def update_group_settings(group_id):
         group.min_votes_required = data['min_votes_required']
     if 'vote_deadline_hours' in data:
         group.vote_deadline_hours = data['vote_deadline_hours']
+        use_group(group)
+        refresh_group_deadlines(group)
+    if 'min_votes_required' in data or 'vote_deadline_hours' in data:
+        request_rescan()
     
     db.session.commit()
+    group_cache.invalidate(group_id)
+    if 'vote_deadline_hours' in data:
+        trending.invalidate(group_id)
+
+    if 'min_votes_required' in data or 'vote_deadline_hours' in data:
+        scheduler.wake()
     
     return jsonify({"message": "Settings updated successfully", "group": group.to_dict()})
 
-# check and delete moves that haven't met vote threshold
+# expired moves are deleted by the background expiry scheduler (expiry.py),
+# this only reports what it has done so older clients keep working
 @groups_bp.route('/<int:group_id>/cleanup-moves', methods=['POST'])
 def cleanup_expired_moves(group_id):
-    from models import Move, Vote
-    from datetime import datetime, timezone, timedelta
-    
-    group = Group.query.get_or_404(group_id)
-    
-    # get all moves in this group
-    moves = Move.query.filter_by(group_id=group_id).all()
-    
-    deleted_count = 0
-    for move in moves:
-        # calculate deadline
-        deadline = move.created_at + timedelta(hours=group.vote_deadline_hours)
-        
-        # check if deadline has passed
-        if datetime.now(timezone.utc) > deadline:
-            # Count votes for this move
-            vote_count = Vote.query.filter_by(move_id=move.id).count()
-            
-            # delete if votes don't meet threshold
-            if vote_count < group.min_votes_required:
-                Vote.query.filter_by(move_id=move.id).delete()
-                db.session.delete(move)
-                deleted_count += 1
-    
-    db.session.commit()
-    
     return jsonify({
-        "message": f"Cleanup complete. {deleted_count} move(s) deleted.",
-        "deleted_count": deleted_count
+        "message": "Expired moves are cleaned up in the background.",
+        "deleted_count": 0,
+        "expiry": shared_stats()
     })
 
 # get member count for a group
 @groups_bp.route('/<int:group_id>/member-count', methods=['GET'])
 def get_member_count(group_id):
+    if not use_group(group_id):
+        return jsonify({"count": 0})
     count = GroupMember.query.filter_by(group_id=group_id).count()
     return jsonify({"count": count})
\ No newline at end of file
@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+
+# gunicorn settings for wsgi:app, each value can be overridden from the environment
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# SQLite allows one writer at a time, extra processes mostly add read capacity;
+# WAL mode (config.py) keeps those reads from blocking on send_message/toggle_vote
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+
+# threaded workers. An open /stream connection keeps a thread for as long as the tab
+# stays open, though not a database connection (the session is released once the
+# response starts), so on top of the GUNICORN_THREADS that serve ordinary requests
+# each worker has GUNICORN_STREAM_THREADS more for streams to sit in
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8)) + int(os.environ.get('GUNICORN_STREAM_THREADS', 64))
+
+# SSE streams send a keepalive every 15s, so the worker timeout only needs to cover that
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# load the app (and run migrations) once in the master before forking
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    # connections opened in the master during preload must not be shared with workers
+    from models import db
+    from wsgi import app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
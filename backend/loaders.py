@@ -0,0 +1,47 @@
+from models import db, User, Group, GroupMember
+from cache import user_cache, group_cache
+from shard_router import fan_out
+
+# batch loaders so listings fetch related rows with one IN (...) query instead of one
+# query per row; each returns {id: row} and silently skips ids that no longer exist
+
+def load_by_ids(model, ids):
+    ids = set(ids)
+    if not ids:
+        return {}
+    return {row.id: row for row in model.query.filter(model.id.in_(ids)).all()}
+
+# serialized rows through the identity cache, only the misses go to the database.
+# the returned dicts are shared with the cache, treat them as read-only
+
+def _cached_dicts(model, cache, ids):
+    ids = set(ids)
+    found = {}
+    for key in ids:
+        cached = cache.get(key)
+        if cached is not None:
+            found[key] = cached
+    for key, row in load_by_ids(model, ids - set(found)).items():
+        found[key] = row.to_dict()
+        cache.set(key, found[key])
+    return found
+
+def user_dicts(ids):
+    return _cached_dicts(User, user_cache, ids)
+
+def group_dicts(ids):
+    return _cached_dicts(Group, group_cache, ids)
+
+def user_dict(user_id):
+    return user_dicts([user_id]).get(user_id)
+
+def group_dict(group_id):
+    return group_dicts([group_id]).get(group_id)
+
+# a user's memberships can be on any shard (sharding.py), read them all in parallel
+
+def member_group_ids(user_id):
+    group_ids = set()
+    for rows in fan_out(lambda: db.session.query(GroupMember.group_id).filter(GroupMember.user_id == user_id).all()):
+        group_ids.update(group_id for (group_id,) in rows)
+    return sorted(group_ids)
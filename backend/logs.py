@@ -0,0 +1,137 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+# structured JSON logging. Request threads only format the record and drop it on an
+# in-memory queue; a listener thread does the actual write to stdout, so a slow or
+# contended stdout never holds up a request. Every record carries the request id
+# (taken from an incoming X-Request-ID header or generated) and any `extra=` fields:
+#
+#   logger = logging.getLogger(__name__)
+#   logger.info('move created', extra={'move_id': move.id, 'group_id': group.id})
+#
+# DEBUG records are sampled by LOG_DEBUG_SAMPLE_RATE, and if the queue ever fills up
+# records are dropped (and counted) rather than blocking the request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_valid_request_id = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+_handler = None
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class DebugSampler(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    dropped = 0
+
+    def prepare(self, record):
+        # format on the calling thread (it still has the request context and the live
+        # objects), the listener only has to write the finished line
+        record = logging.makeLogRecord(vars(record))
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+def _start_listener(maxsize):
+    global _listener
+    _handler.queue = queue.Queue(maxsize=maxsize)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter('%(message)s'))
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # the writer thread doesn't survive fork (gunicorn forks workers after preload_app),
+    # and the parent's queue may have been locked mid-put, so the child gets fresh ones
+    if _handler is not None:
+        _start_listener(_handler.queue.maxsize)
+
+
+def stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def init_logging(app):
+    global _handler
+    app.config.setdefault('LOG_LEVEL', 'INFO')
+    app.config.setdefault('LOG_DEBUG_SAMPLE_RATE', 0.01)
+    app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+
+    root = logging.getLogger()
+    if _handler is None:
+        _handler = NonBlockingQueueHandler(None)
+        _handler.setFormatter(JsonFormatter())
+        _handler.addFilter(DebugSampler(app.config['LOG_DEBUG_SAMPLE_RATE']))
+        _handler.addFilter(RequestIdFilter())
+        _start_listener(app.config['LOG_QUEUE_SIZE'])
+        root.addHandler(_handler)
+        atexit.register(stop_listener)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+    root.setLevel(app.config['LOG_LEVEL'])
+    # app.logger propagates to the root handler instead of writing to stderr itself
+    app.logger.removeHandler(default_handler)
+
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming if _valid_request_id.match(incoming) else uuid.uuid4().hex
+
+    @app.after_request
+    def echo_request_id(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
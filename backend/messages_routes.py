@@ -1,8 +1,41 @@
 from flask import Blueprint, request, jsonify
-from models import db, Message, User
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import aliased
+from models import db, Message, ConversationSummary
+from events import publish, user_channel
+from loaders import user_dicts
+from serialization import projected
+from search import search_messages, highlighted, page_params
+from users_routes import bump_counter, read_messages
+from archive import archived_messages
 
 messages_bp = Blueprint('messages', __name__)
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# full-text search over the messages a user sent or received, best match first
+@messages_bp.route('/user/<int:user_id>/search', methods=['GET'])
+def search_user_messages(user_id):
+    limit, offset = page_params(request.args)
+    hits = search_messages(db.session, user_id, request.args.get('q', ''), limit, offset)
+
+    messages = {m.id: m for m in Message.query.filter(Message.id.in_([hit.id for hit in hits]))} if hits else {}
+    marks = read_marks((m.recipient_id, m.sender_id) for m in messages.values())
+    results = []
+    for hit in hits:
+        message = messages.get(hit.id)
+        if message:
+            results.append(dict(
+                message.to_dict(),
+                read=message.id <= marks.get((message.recipient_id, message.sender_id), 0),
+                snippet=highlighted(hit.snippet)
+            ))
+    return jsonify({
+        'results': projected(results),
+        'next_offset': offset + limit if len(hits) == limit else None
+    })
+
 # gend a message
 @messages_bp.route('/send', methods=['POST'])
 def send_message():
@@ -15,64 +48,239 @@ def send_message():
     )
     
     db.session.add(new_message)
+    db.session.flush()
+
+    _touch_summary(new_message.sender_id, new_message.recipient_id, new_message.id)
+    _touch_summary(new_message.recipient_id, new_message.sender_id, new_message.id)
+    bump_counter([new_message.recipient_id], 'unread_messages', 1)
     db.session.commit()
+
+    # push to both sides so every open chat window updates without polling
+    message_dict = new_message.to_dict()
+    publish(user_channel(new_message.recipient_id), 'message', message_dict)
+    publish(user_channel(new_message.sender_id), 'message', message_dict)
     
     return jsonify({"message": "Message sent successfully"}), 201
 
 # get conversation between two users
+# ?after_id=<id> returns only messages newer than the client's cursor (polling),
+# ?before_id=<id>&limit=<n> pages back through older history
 @messages_bp.route('/conversation/<int:user1_id>/<int:user2_id>', methods=['GET'])
 def get_conversation(user1_id, user2_id):
-    messages = Message.query.filter(
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    summaries = conversation_summaries([(user1_id, user2_id), (user2_id, user1_id)])
+    marks = {key: summary.last_read_message_id for key, summary in summaries.items()}
+    last_archived = max((summary.last_archived_message_id for summary in summaries.values()), default=0)
+
+    query = Message.query.filter(
         ((Message.sender_id == user1_id) & (Message.recipient_id == user2_id)) |
         ((Message.sender_id == user2_id) & (Message.recipient_id == user1_id))
-    ).order_by(Message.created_at.asc()).all()
-    
-    # mark messages as read
-    for msg in messages:
-        if msg.recipient_id == user1_id and not msg.read:
-            msg.read = True
-    
-    db.session.commit()
-    
-    return jsonify([msg.to_dict() for msg in messages])
+    )
+
+    if after_id is not None:
+        # walk forward from the cursor, oldest first
+        query = query.filter(Message.id > after_id).order_by(Message.id.asc())
+        if limit is not None:
+            query = query.limit(limit)
+        messages = query.all()
+        page_size = limit
+        needs_archive = after_id < last_archived
+    elif before_id is not None or limit is not None:
+        # walk backward from the cursor (or from the newest message), then flip to oldest first
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        page_size = limit or DEFAULT_PAGE_SIZE
+        messages = query.order_by(Message.id.desc()).limit(page_size).all()
+        messages.reverse()
+        needs_archive = last_archived > 0 and (
+            len(messages) < page_size or messages[0].id < last_archived
+        )
+    else:
+        # no cursor: full history, kept for older clients
+        messages = query.order_by(Message.id.asc()).all()
+        page_size = None
+        needs_archive = last_archived > 0
+
+    # serialize before committing so the commit doesn't expire and reload every row
+    result = [msg.to_dict() for msg in messages]
+
+    if needs_archive:
+        # the page reaches back past the hot window, fill it in from the archive
+        merged = {m['id']: m for m in archived_messages(user1_id, user2_id, after_id, before_id, page_size)}
+        merged.update((m['id'], m) for m in result)
+        result = [merged[message_id] for message_id in sorted(merged)]
+        if page_size is not None:
+            result = result[:page_size] if after_id is not None else result[-page_size:]
+
+    # user1 has now seen everything returned; the read mark only ever moves forward, so a
+    # poll that brings nothing new from user2 doesn't write at all
+    newest_received = max((m['id'] for m in result if m['sender_id'] == user2_id), default=0)
+    old_mark = marks.get((user1_id, user2_id), 0)
+    if newest_received > old_mark:
+        # a concurrent poll that already moved the mark owns the unread decrement
+        if _advance_read_mark(user1_id, user2_id, newest_received):
+            read_messages(user1_id, user2_id, old_mark, newest_received)
+            db.session.commit()
+        marks[(user1_id, user2_id)] = newest_received
+    for m in result:
+        m['read'] = m['id'] <= marks.get((m['recipient_id'], m['sender_id']), 0)
+
+    return jsonify(projected(result))
 
 # get all conversations for a user (list of people they've messaged)
+# newest first; ?limit=<n>&before_id=<last_message_id> pages through older conversations
 @messages_bp.route('/user/<int:user_id>/conversations', methods=['GET'])
 def get_user_conversations(user_id):
-    # get all unique users this user has messaged or received messages from
-    sent_messages = Message.query.filter_by(sender_id=user_id).all()
-    received_messages = Message.query.filter_by(recipient_id=user_id).all()
-    
-    user_ids = set()
-    for msg in sent_messages:
-        user_ids.add(msg.recipient_id)
-    for msg in received_messages:
-        user_ids.add(msg.sender_id)
-    
+    limit = request.args.get('limit', type=int)
+    before_id = request.args.get('before_id', type=int)
+
+    # unread = messages from the peer past the user's read mark, a range count on
+    # ix_message_sender_recipient_id; the peer's own mark says whether they read ours
+    peer_summary = aliased(ConversationSummary)
+    unread_count = select(func.count(Message.id)).where(
+        Message.sender_id == ConversationSummary.peer_id,
+        Message.recipient_id == ConversationSummary.user_id,
+        Message.id > ConversationSummary.last_read_message_id
+    ).correlate(ConversationSummary).scalar_subquery()
+    query = db.session.query(
+        ConversationSummary, Message, unread_count, peer_summary.last_read_message_id
+    ).join(
+        Message, Message.id == ConversationSummary.last_message_id
+    ).outerjoin(peer_summary, and_(
+        peer_summary.user_id == ConversationSummary.peer_id,
+        peer_summary.peer_id == ConversationSummary.user_id
+    )).filter(ConversationSummary.user_id == user_id)
+
+    if before_id is not None:
+        query = query.filter(ConversationSummary.last_message_id < before_id)
+    query = query.order_by(ConversationSummary.last_message_id.desc())
+    if limit is not None:
+        query = query.limit(max(1, min(limit, MAX_PAGE_SIZE)))
+
+    rows = query.all()
+    users = user_dicts(row[0].peer_id for row in rows)
+
     conversations = []
-    for uid in user_ids:
-        user = User.query.get(uid)
-        if user:
-            # get last message
-            last_msg = Message.query.filter(
-                ((Message.sender_id == user_id) & (Message.recipient_id == uid)) |
-                ((Message.sender_id == uid) & (Message.recipient_id == user_id))
-            ).order_by(Message.created_at.desc()).first()
-            
-            # count unread messages
-            unread_count = Message.query.filter_by(
-                sender_id=uid,
-                recipient_id=user_id,
-                read=False
-            ).count()
-            
-            conversations.append({
-                'user': user.to_dict(),
-                'last_message': last_msg.to_dict() if last_msg else None,
-                'unread_count': unread_count
-            })
-    
-    # sort by last message time
-    conversations.sort(key=lambda x: x['last_message']['created_at'] if x['last_message'] else '', reverse=True)
-    
-    return jsonify(conversations) 
\ No newline at end of file
+    for summary, last_msg, unread, peer_mark in rows:
+        user = users.get(summary.peer_id)
+        if user is None:
+            continue
+        reader_mark = summary.last_read_message_id if last_msg.recipient_id == user_id else peer_mark
+        conversations.append({
+            'user': user,
+            'last_message': dict(last_msg.to_dict(), read=last_msg.id <= (reader_mark or 0)),
+            'unread_count': unread
+        })
+
+    return jsonify(projected(conversations))
+
+def _touch_summary(user_id, peer_id, message_id):
+    # point the (user, peer) summary at the newest message, creating it on first contact
+    updated = ConversationSummary.query.filter_by(user_id=user_id, peer_id=peer_id).update({
+        ConversationSummary.last_message_id: message_id
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(ConversationSummary(
+            user_id=user_id,
+            peer_id=peer_id,
+            last_message_id=message_id,
+            last_read_message_id=0
+        ))
+
+def _advance_read_mark(user_id, peer_id, message_id):
+    # conditional so two racing requests can't move the mark backwards; returns whether
+    # this call moved it. A conversation without a summary row gets one
+    if ConversationSummary.query.filter(
+        ConversationSummary.user_id == user_id,
+        ConversationSummary.peer_id == peer_id,
+        ConversationSummary.last_read_message_id < message_id
+    ).update({ConversationSummary.last_read_message_id: message_id}, synchronize_session=False):
+        return True
+    if db.session.query(ConversationSummary.id).filter_by(user_id=user_id, peer_id=peer_id).first():
+        return False
+    last_message_id = db.session.query(func.max(Message.id)).filter(or_(
+        and_(Message.sender_id == user_id, Message.recipient_id == peer_id),
+        and_(Message.sender_id == peer_id, Message.recipient_id == user_id)
+    )).scalar()
+    db.session.add(ConversationSummary(
+        user_id=user_id,
+        peer_id=peer_id,
+        last_message_id=max(last_message_id or 0, message_id),
+        last_read_message_id=message_id
+    ))
+    return True
+
+def conversation_summaries(pairs):
+    # {(reader_id, peer_id): row with the read and archive marks} for the given pairs, in
+    # one query (OR'd pairs rather than a row-value IN, which SQLite can't use the unique
+    # index for)
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    rows = db.session.query(
+        ConversationSummary.user_id, ConversationSummary.peer_id,
+        ConversationSummary.last_read_message_id, ConversationSummary.last_archived_message_id
+    ).filter(or_(*(
+        and_(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+        for user_id, peer_id in pairs
+    ))).all()
+    return {(row.user_id, row.peer_id): row for row in rows}
+
+def read_marks(pairs):
+    # {(reader_id, peer_id): last_read_message_id}
+    return {key: row.last_read_message_id for key, row in conversation_summaries(pairs).items()}
+
+def rebuild_conversation_summaries():
+    # recompute every summary from the Message table, used to backfill existing databases.
+    # Existing read and archive marks are kept. Archiving never moves a conversation's
+    # newest message, so the last message is always in the Message table. A pair without
+    # a read mark starts just before its oldest message still flagged unread; only
+    # imports such as datagen.py set Message.read
+    last_ids = {}
+    pairs = db.session.query(
+        Message.sender_id, Message.recipient_id, func.max(Message.id)
+    ).group_by(Message.sender_id, Message.recipient_id).all()
+    for sender_id, recipient_id, max_id in pairs:
+        for key in ((sender_id, recipient_id), (recipient_id, sender_id)):
+            last_ids[key] = max(last_ids.get(key, 0), max_id)
+
+    received = {}
+    for sender_id, recipient_id, max_id in pairs:
+        received[(recipient_id, sender_id)] = max_id
+    first_unread = dict(((recipient_id, sender_id), min_id) for sender_id, recipient_id, min_id in db.session.query(
+        Message.sender_id, Message.recipient_id, func.min(Message.id)
+    ).filter(Message.read == False).group_by(Message.sender_id, Message.recipient_id).all())
+    marks = {}
+    archived = {}
+    for user_id, peer_id, mark, archived_id in db.session.query(
+        ConversationSummary.user_id, ConversationSummary.peer_id,
+        ConversationSummary.last_read_message_id, ConversationSummary.last_archived_message_id
+    ):
+        marks[(user_id, peer_id)] = mark
+        archived[(user_id, peer_id)] = archived_id
+
+    def read_mark(key):
+        if key in marks:
+            return marks[key]
+        if key in first_unread:
+            return first_unread[key] - 1
+        return received.get(key, 0)
+
+    ConversationSummary.query.delete()
+    db.session.bulk_insert_mappings(ConversationSummary, [
+        {
+            'user_id': user_id,
+            'peer_id': peer_id,
+            'last_message_id': last_id,
+            'last_read_message_id': read_mark((user_id, peer_id)),
+            'last_archived_message_id': archived.get((user_id, peer_id), 0)
+        }
+        for (user_id, peer_id), last_id in last_ids.items()
+    ])
+    db.session.commit()
+    return len(last_ids)
@@ -0,0 +1,174 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+# per-request latency and SQL instrumentation, exposed in Prometheus text format at
+# /metrics. counters live in this process, so each worker reports its own numbers and
+# the scraper sums them across instances
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+ENDPOINT_LABELS = ('blueprint', 'endpoint', 'method')
+
+request_duration = Histogram(
+    'moves_http_request_duration_seconds', 'Request latency.', ENDPOINT_LABELS)
+requests_total = Counter(
+    'moves_http_requests_total', 'Requests served.', ENDPOINT_LABELS + ('status',))
+db_queries = Histogram(
+    'moves_db_queries_per_request', 'SQL statements executed per request.', ENDPOINT_LABELS,
+    buckets=(1, 2, 3, 5, 10, 25, 50, 100, 250))
+db_time = Counter(
+    'moves_db_time_seconds_total', 'Time spent executing SQL.', ('blueprint', 'endpoint'))
+slow_requests = Counter(
+    'moves_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', ENDPOINT_LABELS)
+
+METRICS = [request_duration, requests_total, db_queries, db_time, slow_requests]
+
+# extra gauges, each callable returns [(name, help, {label tuple: value}, labelnames)]
+_collectors = []
+
+
+def register_collector(collect):
+    _collectors.append(collect)
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    for collect in _collectors:
+        for name, help, samples, labelnames in collect():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples.items():
+                lines.append(f'{name}{_labels(labelnames, labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _endpoint_labels():
+    endpoint = request.endpoint or 'unmatched'
+    return (request.blueprint or '', endpoint, request.method)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'metrics_started' in g:
+        g.metrics_queries += 1
+        g.metrics_db_time += elapsed
+        if len(g.metrics_statements) < g.metrics_max_statements:
+            g.metrics_statements.append((statement, elapsed))
+    else:
+        db_time.inc(('', 'background'), elapsed)
+
+
+def init_metrics(app, db):
+    app.config.setdefault('SLOW_REQUEST_MS', 500)
+    app.config.setdefault('SLOW_REQUEST_MAX_STATEMENTS', 50)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+        g.metrics_statements = []
+        g.metrics_max_statements = app.config['SLOW_REQUEST_MAX_STATEMENTS']
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        labels = _endpoint_labels()
+        request_duration.observe(labels, elapsed)
+        requests_total.inc(labels + (str(response.status_code),))
+        db_queries.observe(labels, g.metrics_queries)
+        db_time.inc(labels[:2], g.metrics_db_time)
+
+        threshold = app.config['SLOW_REQUEST_MS']
+        if threshold is not None and elapsed * 1000 >= threshold:
+            slow_requests.inc(labels)
+            statements = '\n'.join(
+                f"    {seconds * 1000:8.2f} ms  {' '.join(sql.split())}" for sql, seconds in g.metrics_statements
+            )
+            app.logger.warning(
+                "slow request %s %s -> %s in %.1f ms, %d queries (%.1f ms in SQL)\n%s",
+                request.method, request.full_path, response.status_code, elapsed * 1000,
+                g.metrics_queries, g.metrics_db_time * 1000, statements
+            )
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,242 @@
+from datetime import datetime, timezone
+from sqlalchemy import func, inspect, select, text
+from models import db, SchemaMigration
+from shard_router import shard_engines, is_sharded
+
+# versioned schema changes for databases created before a column or index existed.
+# db.create_all() builds fresh databases straight from models.py, so every step here
+# checks what is already there and is a no-op on a new database.
+# add new steps to the end of MIGRATIONS, never renumber or edit an applied one; a step
+# that has to run between existing ones (10, 11, 13) takes the next number but is listed
+# where it runs.
+# Steps run against the main database only: extra shards (sharding.py) are created
+# from the models when first configured, so a step that changes a group-scoped table
+# must also run against shard_engines()
+
+
+def _has_column(conn, table, column):
+    return any(c['name'] == column for c in inspect(conn).get_columns(table))
+
+
+def _create_indexes(conn, model, names):
+    # the index definitions live in the model's __table_args__
+    indexes = {index.name: index for index in model.__table__.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def _add_move_expires_at(conn):
+    from models import Move
+    if not _has_column(conn, 'move', 'expires_at'):
+        conn.execute(text('ALTER TABLE move ADD COLUMN expires_at DATETIME'))
+    # values are backfilled by the expiry scheduler / `flask expire-moves`
+    _create_indexes(conn, Move, ['ix_move_expires_at'])
+
+
+def _add_move_vote_count(conn):
+    if not _has_column(conn, 'move', 'vote_count'):
+        conn.execute(text('ALTER TABLE move ADD COLUMN vote_count INTEGER NOT NULL DEFAULT 0'))
+        conn.execute(text(
+            'UPDATE move SET vote_count = (SELECT COUNT(vote.id) FROM vote WHERE vote.move_id = move.id)'
+        ))
+
+
+def _add_vote_unique_index(conn):
+    from models import Vote
+    # keep the oldest of any duplicate votes so the unique index can be built
+    conn.execute(text(
+        'DELETE FROM vote WHERE id NOT IN (SELECT MIN(id) FROM vote GROUP BY move_id, user_id)'
+    ))
+    _create_indexes(conn, Vote, ['uq_vote_move_user'])
+    conn.execute(text(
+        'UPDATE move SET vote_count = (SELECT COUNT(vote.id) FROM vote WHERE vote.move_id = move.id)'
+    ))
+
+
+def _add_route_indexes(conn):
+    from models import GroupMember, Move, Message, Friendship, GroupInvitation
+    _create_indexes(conn, GroupMember, ['ix_group_member_group_user', 'ix_group_member_user_group'])
+    _create_indexes(conn, Move, ['ix_move_group_id'])
+    _create_indexes(conn, Message, ['ix_message_sender_recipient_id'])
+    _create_indexes(conn, Friendship, [
+        'ix_friendship_user_friend', 'ix_friendship_user_status', 'ix_friendship_friend_status'
+    ])
+    _create_indexes(conn, GroupInvitation, [
+        'ix_group_invitation_user_status', 'ix_group_invitation_group_user_status'
+    ])
+
+
+def _add_search_indexes(conn):
+    # FTS5 tables and their sync triggers (search.py), SQLite only
+    from search import create_search_schema
+    if conn.dialect.name == 'sqlite':
+        create_search_schema(conn)
+
+
+def _initial_read_mark(row):
+    # a read mark from the per-message read flags of the conversation `row` (a table or
+    # alias with user_id and peer_id): just before the oldest unread message
+    return f"""COALESCE(
+                (SELECT MIN(m.id) - 1 FROM message m WHERE m.sender_id = {row}.peer_id
+                    AND m.recipient_id = {row}.user_id AND m.read = 0),
+                (SELECT MAX(m.id) FROM message m WHERE m.sender_id = {row}.peer_id
+                    AND m.recipient_id = {row}.user_id),
+                0)"""
+
+
+def _backfill_conversation_summaries(conn):
+    # a summary row for every conversation that has none, e.g. from before the table
+    # existed. Runs before step 6, so the table may still have unread_count instead of
+    # the read mark
+    columns, values = ['user_id', 'peer_id', 'last_message_id'], ['p.user_id', 'p.peer_id', 'MAX(p.last_id)']
+    if _has_column(conn, 'conversation_summary', 'last_read_message_id'):
+        columns.append('last_read_message_id')
+        values.append(_initial_read_mark('p'))
+    if _has_column(conn, 'conversation_summary', 'unread_count'):
+        columns.append('unread_count')
+        values.append('(SELECT COUNT(*) FROM message m WHERE m.sender_id = p.peer_id'
+                      ' AND m.recipient_id = p.user_id AND m.read = 0)')
+    conn.execute(text(f"""
+        INSERT INTO conversation_summary ({', '.join(columns)})
+        SELECT {', '.join(values)}
+        FROM (
+            SELECT recipient_id AS user_id, sender_id AS peer_id, MAX(id) AS last_id
+                FROM message GROUP BY sender_id, recipient_id
+            UNION ALL
+            SELECT sender_id, recipient_id, MAX(id) FROM message GROUP BY sender_id, recipient_id
+        ) p
+        WHERE NOT EXISTS (SELECT 1 FROM conversation_summary cs
+            WHERE cs.user_id = p.user_id AND cs.peer_id = p.peer_id)
+        GROUP BY p.user_id, p.peer_id
+    """))
+
+
+def _add_read_marks(conn):
+    # per-conversation read high-water mark replaces the per-message read flag and the
+    # unread counter; the mark stops just before the oldest unread message
+    if not _has_column(conn, 'conversation_summary', 'last_read_message_id'):
+        conn.execute(text(
+            'ALTER TABLE conversation_summary ADD COLUMN last_read_message_id INTEGER NOT NULL DEFAULT 0'
+        ))
+        conn.execute(text(
+            f'UPDATE conversation_summary SET last_read_message_id = {_initial_read_mark("conversation_summary")}'
+        ))
+    if _has_column(conn, 'conversation_summary', 'unread_count'):
+        conn.execute(text('ALTER TABLE conversation_summary DROP COLUMN unread_count'))
+
+
+def _add_user_counters(conn):
+    # the table itself comes from create_all(), fill in rows for existing users
+    from users_routes import COUNTERS_INSERT
+    conn.execute(text(COUNTERS_INSERT + ' WHERE u.id NOT IN (SELECT user_id FROM user_counters)'))
+
+
+def _recount_user_counters(conn):
+    # step 7 counted unread messages before any summary was backfilled; recount every
+    # user now that step 10 has run. Group invitations on extra shards come in step 13
+    from users_routes import COUNTERS_INSERT
+    conn.execute(text('DELETE FROM user_counters'))
+    conn.execute(text(COUNTERS_INSERT))
+
+
+def _add_shard_invitation_counts(conn):
+    # step 11 only counted pending group invitations in the main database; recount them
+    # with the ones on every extra shard, each read on a connection of its own
+    from models import GroupInvitation
+    shards = shard_engines()[1:]
+    if not shards:
+        return
+    conn.execute(text("""
+        UPDATE user_counters SET pending_group_invitations = (SELECT COUNT(*) FROM group_invitation gi
+            WHERE gi.user_id = user_counters.user_id AND gi.status = 'pending')
+    """))
+    invitations = GroupInvitation.__table__
+    pending = select(invitations.c.user_id, func.count()).where(
+        invitations.c.status == 'pending'
+    ).group_by(invitations.c.user_id)
+    for shard, engine in shards:
+        with engine.connect() as shard_conn:
+            counts = shard_conn.execute(pending).all()
+        if counts:
+            conn.execute(text(
+                'UPDATE user_counters SET pending_group_invitations = pending_group_invitations + :pending'
+                ' WHERE user_id = :user_id'
+            ), [{'user_id': user_id, 'pending': count} for user_id, count in counts])
+
+
+def _add_archive_marks(conn):
+    # the archive table lives in its own database and comes from create_all()
+    if not _has_column(conn, 'conversation_summary', 'last_archived_message_id'):
+        conn.execute(text(
+            'ALTER TABLE conversation_summary ADD COLUMN last_archived_message_id INTEGER NOT NULL DEFAULT 0'
+        ))
+
+
+def _add_group_shards(conn):
+    # every existing group starts on shard 0, the main database
+    if not _has_column(conn, 'group', 'shard'):
+        conn.execute(text('ALTER TABLE "group" ADD COLUMN shard INTEGER NOT NULL DEFAULT 0'))
+    if not _has_column(conn, 'group', 'shard_moving'):
+        conn.execute(text('ALTER TABLE "group" ADD COLUMN shard_moving BOOLEAN NOT NULL DEFAULT 0'))
+
+
+def _add_expiry_state(conn):
+    # the table comes from create_all(), the row everyone updates from here
+    conn.execute(text(
+        'INSERT INTO expiry_state (id, rescan_requests) SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM expiry_state)'
+    ))
+
+
+MIGRATIONS = [
+    (1, 'add move.expires_at', _add_move_expires_at),
+    (2, 'add move.vote_count', _add_move_vote_count),
+    (3, 'unique vote per user per move', _add_vote_unique_index),
+    (4, 'indexes for route query shapes', _add_route_indexes),
+    (5, 'full-text search over messages and moves', _add_search_indexes),
+    # out of order: summaries have to exist before read marks and counters are derived
+    (10, 'backfill conversation summaries', _backfill_conversation_summaries),
+    (6, 'conversation read marks instead of unread counters', _add_read_marks),
+    (7, 'per-user badge counters', _add_user_counters),
+    (11, 'recount badge counters from conversation summaries', _recount_user_counters),
+    (13, 'badge invitation counts from every shard', _add_shard_invitation_counts),
+    (8, 'hot/cold message archive marks', _add_archive_marks),
+    (9, 'group shard directory', _add_group_shards),
+    (12, 'shared expiry scheduler state', _add_expiry_state),
+]
+
+
+def applied_versions():
+    return {m.version for m in SchemaMigration.query.all()}
+
+
+def create_shard_schemas():
+    # group-scoped tables and move search on shards 1..n; shard 0 is the main database
+    from search import create_search_schema, SHARD_FTS_TABLES
+    tables = [table for table in db.metadata.sorted_tables if is_sharded(table)]
+    for shard, engine in shard_engines()[1:]:
+        db.metadata.create_all(engine, tables=tables)
+        if engine.dialect.name == 'sqlite':
+            with engine.begin() as conn:
+                if not inspect(conn).has_table('move_fts'):
+                    create_search_schema(conn, SHARD_FTS_TABLES)
+
+
+def upgrade():
+    # create any missing tables, then apply pending migrations in order, each in its own
+    # transaction; returns the versions that were applied
+    db.create_all()
+    create_shard_schemas()
+    done = applied_versions()
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with db.engine.begin() as conn:
+            migrate(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(
+                version=version,
+                description=description,
+                applied_at=datetime.now(timezone.utc)
+            ))
+        applied.append(version)
+    return applied
@@ -1,7 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
+from shard_router import ShardSession, SHARDED
 
-db = SQLAlchemy()
+# group-scoped models end their __table_args__ with SHARDED and live on the group's
+# shard (see shard_router.py / sharding.py), everything else in the main database
+db = SQLAlchemy(session_options={'class_': ShardSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -26,6 +29,8 @@ class Group(db.Model):
     min_votes_required = db.Column(db.Integer, default=3)  # Minimum votes needed
     vote_deadline_hours = db.Column(db.Integer, default=24)  # Hours to reach votes
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    shard = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # where its moves etc. live
+    shard_moving = db.Column(db.Boolean, default=False, server_default='0', nullable=False)  # set by move_group
     
     def to_dict(self):
         return {
@@ -39,6 +44,12 @@ class Group(db.Model):
         } 
     
 class GroupMember(db.Model):
+    __table_args__ = (
+        db.Index('ix_group_member_group_user', 'group_id', 'user_id'),
+        db.Index('ix_group_member_user_group', 'user_id', 'group_id'),
+        SHARDED,
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -53,12 +64,19 @@ class GroupMember(db.Model):
         }
     
 class Move(db.Model):
+    __table_args__ = (
+        db.Index('ix_move_group_id', 'group_id'),
+        SHARDED,
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(500))
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime, index=True)  # voting deadline, swept by expiry.py
+    vote_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # kept in sync by toggle_vote
 
     def to_dict(self):
         return {
@@ -67,10 +85,17 @@ class Move(db.Model):
             'description': self.description,
             'group_id': self.group_id,
             'created_by': self.created_by,
+            'vote_count': self.vote_count,
             'created_at': self.created_at.isoformat()
         }
 
 class Vote(db.Model):
+    __table_args__ = (
+        # one vote per user per move, even when two toggles race
+        db.Index('uq_vote_move_user', 'move_id', 'user_id', unique=True),
+        SHARDED,
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     move_id = db.Column(db.Integer, db.ForeignKey('move.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -85,6 +110,12 @@ class Vote(db.Model):
         } 
     
 class Friendship(db.Model):
+    __table_args__ = (
+        db.Index('ix_friendship_user_friend', 'user_id', 'friend_id'),
+        db.Index('ix_friendship_user_status', 'user_id', 'status'),
+        db.Index('ix_friendship_friend_status', 'friend_id', 'status'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     friend_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -101,6 +132,12 @@ class Friendship(db.Model):
         }
 
 class GroupInvitation(db.Model):
+    __table_args__ = (
+        db.Index('ix_group_invitation_user_status', 'user_id', 'status'),
+        db.Index('ix_group_invitation_group_user_status', 'group_id', 'user_id', 'status'),
+        SHARDED,
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Person being invited
@@ -119,6 +156,11 @@ class GroupInvitation(db.Model):
         } 
 
 class Message(db.Model):
+    __table_args__ = (
+        # keyset pagination over a conversation: (sender, recipient) then id
+        db.Index('ix_message_sender_recipient_id', 'sender_id', 'recipient_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -134,4 +176,86 @@ class Message(db.Model):
             'content': self.content,
             'read': self.read,
             'created_at': self.created_at.isoformat()
-        } 
\ No newline at end of file
+        }
+
+class ConversationSummary(db.Model):
+    # one row per (user, peer) pair, kept up to date by the message write paths.
+    # last_read_message_id is the user's read receipt for the conversation: messages
+    # from peer with a higher id are unread. last_archived_message_id is the newest
+    # message archive.py moved to the cold tier, 0 while the conversation is all hot
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'peer_id', name='uq_conversation_summary_user_peer'),
+        db.Index('ix_conversation_summary_user_last', 'user_id', 'last_message_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    last_read_message_id = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    last_archived_message_id = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'peer_id': self.peer_id,
+            'last_message_id': self.last_message_id,
+            'last_read_message_id': self.last_read_message_id,
+            'last_archived_message_id': self.last_archived_message_id
+        }
+
+class MessageArchiveBlock(db.Model):
+    # cold tier for old messages (see archive.py), in its own database. Each block
+    # holds up to ARCHIVE_BLOCK_SIZE messages of one conversation as zlib-compressed
+    # JSON; user_low < user_high identifies the conversation from either side
+    __bind_key__ = 'archive'
+    __table_args__ = (
+        db.Index('ix_message_archive_block_pair_last', 'user_low', 'user_high', 'last_message_id'),
+        db.Index('ix_message_archive_block_pair_first', 'user_low', 'user_high', 'first_message_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_low = db.Column(db.Integer, nullable=False)
+    user_high = db.Column(db.Integer, nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+class UserCounters(db.Model):
+    # badge counts per user, maintained by the write paths that change them
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    pending_friend_requests = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    pending_group_invitations = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    unread_messages = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'pending_friend_requests': self.pending_friend_requests,
+            'pending_group_invitations': self.pending_group_invitations,
+            'unread_messages': self.unread_messages
+        }
+
+class ExpiryState(db.Model):
+    # a single row (id 1) that web processes and the expiry worker share: requests bump
+    # rescan_requests when moves that already expired may now need deleting, and the
+    # scheduler stores the stats of its last run for /cleanup-moves to report
+    id = db.Column(db.Integer, primary_key=True)
+    rescan_requests = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    stats = db.Column(db.Text)
+
+class ShardIdBlock(db.Model):
+    # next free id per sharded table, handed out in blocks so ids stay unique across
+    # shards (see sharding.IdAllocator); only used once extra shards are configured.
+    # In its own database (config.SHARD_ID_DATABASE_URL), never written by a request's session
+    __bind_key__ = 'ids'
+    table_name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+class SchemaMigration(db.Model):
+    # versions applied by migrations.py
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
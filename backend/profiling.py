@@ -0,0 +1,156 @@
+import cProfile
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from flask import Blueprint, abort, current_app, g, jsonify, request, send_from_directory
+
+# opt-in cProfile capture. A request is profiled when it is picked by PROFILE_SAMPLE_RATE,
+# or every request is profiled and kept only if it ran longer than PROFILE_SLOW_MS.
+# profiles land in PROFILE_DIR as <stamp>-<endpoint>-<ms>ms-<id>.pstats next to a .json
+# with the path, arguments and timings; only the newest PROFILE_KEEP are kept.
+#
+#   PROFILE_SLOW_MS=1000 gunicorn wsgi:app
+#   curl localhost:8000/admin/profiles
+#   curl -O localhost:8000/admin/profiles/<name>.pstats
+#   python -m pstats <name>.pstats
+#
+# cProfile only sees the thread it was enabled on, and newer Pythons allow one active
+# profiler per process, so a request that can't get the profiler just runs unprofiled
+
+profiles_bp = Blueprint('profiles', __name__)
+
+_write_lock = threading.Lock()
+_safe_name = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def profiling_enabled(config):
+    return bool(config['PROFILE_SAMPLE_RATE']) or config['PROFILE_SLOW_MS'] is not None
+
+
+def _should_profile(config):
+    if config['PROFILE_SLOW_MS'] is not None:
+        return True
+    return random.random() < config['PROFILE_SAMPLE_RATE']
+
+
+def _start_profile():
+    if request.blueprint == profiles_bp.name or not _should_profile(current_app.config):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+
+
+def _finish_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    elapsed_ms = (time.perf_counter() - g.profile_started) * 1000
+    config = current_app.config
+    slow_ms = config['PROFILE_SLOW_MS']
+    sampled = slow_ms is None or elapsed_ms >= slow_ms
+    if sampled:
+        save_profile(profiler, config['PROFILE_DIR'], config['PROFILE_KEEP'], {
+            'endpoint': request.endpoint or 'unmatched',
+            'method': request.method,
+            'path': request.path,
+            'args': request.args.to_dict(flat=False),
+            'view_args': request.view_args or {},
+            'status': response.status_code,
+            'request_id': g.get('request_id'),
+            'elapsed_ms': round(elapsed_ms, 2),
+            'captured_at': datetime.now(timezone.utc).isoformat()
+        })
+    return response
+
+
+def _discard_profile(exc):
+    # a request that raised never reaches after_request, don't leave its profiler running
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def save_profile(profiler, directory, keep, info):
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    endpoint = _safe_name.sub('_', info['endpoint'])
+    name = f"{stamp}-{endpoint}-{int(info['elapsed_ms'])}ms-{uuid.uuid4().hex[:8]}"
+    with _write_lock:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, f'{name}.pstats'))
+        with open(os.path.join(directory, f'{name}.json'), 'w') as f:
+            json.dump(dict(info, name=name), f)
+        _trim(directory, keep)
+    return name
+
+
+def _trim(directory, keep):
+    names = sorted(f[:-len('.pstats')] for f in os.listdir(directory) if f.endswith('.pstats'))
+    for name in names[:max(0, len(names) - keep)]:
+        for suffix in ('.pstats', '.json'):
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(directory):
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+@profiles_bp.route('/profiles', methods=['GET'])
+def get_profiles():
+    return jsonify(list_profiles(current_app.config['PROFILE_DIR']))
+
+
+@profiles_bp.route('/profiles/<filename>', methods=['GET'])
+def download_profile(filename):
+    if not filename.endswith(('.pstats', '.json')):
+        abort(404)
+    return send_from_directory(
+        os.path.abspath(current_app.config['PROFILE_DIR']), filename, as_attachment=True
+    )
+
+
+@profiles_bp.before_request
+def check_admin_token():
+    token = current_app.config['PROFILE_ADMIN_TOKEN']
+    if token and request.headers.get('X-Admin-Token') != token:
+        return jsonify({"error": "Unauthorized"}), 401
+
+
+def init_profiling(app):
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_SLOW_MS', None)
+    if not app.config.get('PROFILE_DIR'):
+        app.config['PROFILE_DIR'] = os.path.join(app.instance_path, 'profiles')
+    app.config.setdefault('PROFILE_KEEP', 50)
+    app.config.setdefault('PROFILE_ADMIN_TOKEN', None)
+    if not profiling_enabled(app.config):
+        return
+
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_discard_profile)
+    app.register_blueprint(profiles_bp, url_prefix='/admin')
@@ -0,0 +1,241 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from flask import jsonify, request
+from sqlalchemy import event
+
+# token-bucket rate limiting and load shedding, checked before every request.
+#
+# Each client gets a bucket per endpoint that refills at `rate` requests per second up
+# to `burst`; an empty bucket answers 429 with Retry-After. Limits come from
+# RATELIMITS, keyed by endpoint ('votes.toggle_vote') or blueprint ('messages'), the
+# most specific key wins and None turns limiting off for it. Buckets live in a
+# backend: MemoryBackend is per process, SQLiteBackend keeps them in a small local
+# file every worker on the host shares (RATELIMIT_STORAGE_URL='sqlite:///path').
+#
+# Separately, a decaying average of SQL statement time tracks how busy the database
+# is. Past LOAD_SHED_DB_LATENCY_MS, LOW_PRIORITY endpoints are answered with 503 straight
+# away, whatever their method; past twice that, so is every read except HIGH_PRIORITY
+# ones, so writes and the chat/vote paths keep the writer
+
+# endpoints that can wait: dropped first when the database is slow
+LOW_PRIORITY = {
+    'groups.cleanup_expired_moves',
+    'friends.get_user_profile',
+    'friends.get_mutual_friends',
+    'friends.get_friend_suggestions',
+    'friends.search_users',
+    'messages.search_user_messages',
+    'api.search_group_moves',
+    'users.get_badges',
+    'profiles.get_profiles',
+    'profiles.download_profile',
+}
+# reads that are never shed
+HIGH_PRIORITY = {'home', 'metrics', 'stream.stream_user_events'}
+
+# ids in the path, query string or body that name the acting user, in order of preference
+_USER_VIEW_ARGS = ('user_id', 'user1_id')
+_USER_QUERY_ARGS = ('user_id', 'current_user_id')
+_USER_BODY_FIELDS = ('user_id', 'sender_id', 'created_by', 'added_by')
+
+
+class MemoryBackend:
+    # buckets for this process only
+    PRUNE_EVERY = 10000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, rate, burst, now):
+        # returns 0 when a token was taken, otherwise seconds until one is available
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        # drop buckets untouched for an hour, they would be full again anyway
+        stale = [key for key, (_, stamp) in self._buckets.items() if now - stamp > 3600]
+        for key in stale:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    # buckets in a local SQLite file, so every worker process on the host draws from the
+    # same ones; a stand-in for a shared store such as Redis. The file holds nothing
+    # that matters across restarts, hence synchronous=OFF
+    PRUNE_EVERY = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_bucket (key TEXT PRIMARY KEY, tokens REAL, stamp REAL)'
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, stamp FROM rate_limit_bucket WHERE key = ?', (key,)).fetchone()
+            tokens, stamp = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - stamp) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            conn.execute(
+                'INSERT INTO rate_limit_bucket (key, tokens, stamp) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, stamp = excluded.stamp',
+                (key, tokens - 1 if wait == 0 else tokens, now)
+            )
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM rate_limit_bucket WHERE stamp < ?', (now - 3600,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM rate_limit_bucket').fetchone()[0]
+
+
+def backend_from_url(url):
+    if url in (None, '', 'memory://'):
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    raise ValueError(f"unsupported RATELIMIT_STORAGE_URL: {url}")
+
+
+class DbLatency:
+    # average SQL statement time; each statement counts for 10% and the average
+    # halves for every HALF_LIFE seconds without one, so shedding stops once the
+    # database goes quiet
+    HALF_LIFE = 5.0
+    WEIGHT = 0.1
+
+    def __init__(self):
+        self._average = 0.0
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _decayed(self, now):
+        return self._average * 0.5 ** ((now - self._stamp) / self.HALF_LIFE)
+
+    def observe(self, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self._average = self._decayed(now) * (1 - self.WEIGHT) + seconds * self.WEIGHT
+            self._stamp = now
+
+    def current_ms(self):
+        with self._lock:
+            return self._decayed(time.monotonic()) * 1000
+
+
+db_latency = DbLatency()
+rejected = {'rate_limited': 0, 'shed': 0}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._ratelimit_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_ratelimit_started', None)
+    if started is not None:
+        db_latency.observe(time.perf_counter() - started)
+
+
+def client_key():
+    # no sessions in this API, so the acting user is whoever the request names; anything
+    # that names no one is limited by address
+    for name in _USER_VIEW_ARGS:
+        if name in (request.view_args or {}):
+            return f"u{request.view_args[name]}"
+    for name in _USER_QUERY_ARGS:
+        if request.args.get(name):
+            return f"u{request.args[name]}"
+    body = request.get_json(silent=True) if request.is_json else None
+    if isinstance(body, dict):
+        for name in _USER_BODY_FIELDS:
+            if body.get(name) is not None:
+                return f"u{body[name]}"
+    return f"ip{request.remote_addr}"
+
+
+def limit_for(limits, endpoint, blueprint):
+    for key in (endpoint, blueprint):
+        if key in limits:
+            return limits[key]
+    return limits.get('default')
+
+
+def init_ratelimit(app, db, backend=None):
+    app.config.setdefault('RATELIMIT_ENABLED', True)
+    app.config.setdefault('RATELIMIT_STORAGE_URL', 'memory://')
+    app.config.setdefault('RATELIMITS', {'default': (20, 40)})
+    app.config.setdefault('LOAD_SHED_DB_LATENCY_MS', 100)
+    app.extensions['ratelimit'] = backend or backend_from_url(app.config['RATELIMIT_STORAGE_URL'])
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def check_limits():
+        endpoint = request.endpoint
+        # unmatched routes and CORS preflights cost nothing
+        if endpoint is None or request.method == 'OPTIONS':
+            return None
+
+        threshold = app.config['LOAD_SHED_DB_LATENCY_MS']
+        if threshold and endpoint not in HIGH_PRIORITY:
+            latency = db_latency.current_ms()
+            if ((latency > threshold and endpoint in LOW_PRIORITY)
+                    or (latency > 2 * threshold and request.method == 'GET')):
+                rejected['shed'] += 1
+                response = jsonify({"error": "Server busy, try again shortly"})
+                response.status_code = 503
+                response.headers['Retry-After'] = '1'
+                return response
+
+        if not app.config['RATELIMIT_ENABLED']:
+            return None
+        limit = limit_for(app.config['RATELIMITS'], endpoint, request.blueprint)
+        if limit is None:
+            return None
+        rate, burst = limit
+        wait = app.extensions['ratelimit'].take(f"{client_key()}:{endpoint}", rate, burst, time.time())
+        if wait:
+            rejected['rate_limited'] += 1
+            response = jsonify({"error": "Too many requests"})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+            return response
+        return None
@@ -1,84 +1,124 @@
-from flask import Blueprint, request, jsonify
+import logging
+from flask import Blueprint, request, jsonify, abort
 from models import db, Move, User, Group, Vote
 from datetime import datetime, timezone, timedelta
+from events import publish, group_channel
+from expiry import scheduler, deadline_for
+from serialization import projected
+from search import search_moves, highlighted, page_params
+from trending import trending
+from sharding import use_group, use_group_of
 
 api = Blueprint('api', __name__)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRENDING_LIMIT = 20
+MAX_TRENDING_LIMIT = 100
+
+# Serialize a move with its voting deadline info
+def move_with_deadline(move, group, now=None):
+    move_dict = move.to_dict()
+
+    # Make created_at timezone-aware if it isn't already
+    created_at = move.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+
+    # Calculate time remaining
+    deadline = created_at + timedelta(hours=group.vote_deadline_hours)
+    if now is None:
+        now = datetime.now(timezone.utc)
+    time_remaining = (deadline - now).total_seconds()
+
+    move_dict['deadline'] = deadline.isoformat()
+    move_dict['time_remaining_seconds'] = max(0, time_remaining)
+    move_dict['is_expired'] = time_remaining <= 0
+    return move_dict
 
 # Get all moves for a specific group
+# ?sort=trending&limit=<n> returns only the top n by decayed vote score (trending.py)
 @api.route('/groups/<int:group_id>/moves', methods=['GET'])
 def get_moves(group_id):
     group = Group.query.get_or_404(group_id)
+    use_group(group)
+    now = datetime.now(timezone.utc)
+
+    if request.args.get('sort') == 'trending':
+        limit = max(1, min(request.args.get('limit', DEFAULT_TRENDING_LIMIT, type=int), MAX_TRENDING_LIMIT))
+        ranked = trending.top(group, limit)
+        moves = {m.id: m for m in Move.query.filter(Move.id.in_([move_id for move_id, _ in ranked]))} if ranked else {}
+        return jsonify(projected([
+            dict(move_with_deadline(moves[move_id], group, now), trending_score=round(score, 4))
+            for move_id, score in ranked if move_id in moves
+        ]))
+
     moves = Move.query.filter_by(group_id=group_id).all()
-    
-    moves_data = []
-    for move in moves:
-        move_dict = move.to_dict()
-        
-        # Make created_at timezone-aware if it isn't already
-        created_at = move.created_at
-        if created_at.tzinfo is None:
-            created_at = created_at.replace(tzinfo=timezone.utc)
-        
-        # Calculate time remaining
-        deadline = created_at + timedelta(hours=group.vote_deadline_hours)
-        now = datetime.now(timezone.utc)
-        time_remaining = (deadline - now).total_seconds()
-        
-        move_dict['deadline'] = deadline.isoformat()
-        move_dict['time_remaining_seconds'] = max(0, time_remaining)
-        move_dict['is_expired'] = time_remaining <= 0
-        
-        moves_data.append(move_dict)
-    
-    return jsonify(moves_data)
+    return jsonify(projected([move_with_deadline(move, group, now) for move in moves]))
+
+# full-text search over a group's moves, name matches rank above description matches
+@api.route('/groups/<int:group_id>/moves/search', methods=['GET'])
+def search_group_moves(group_id):
+    group = Group.query.get_or_404(group_id)
+    use_group(group)
+    limit, offset = page_params(request.args)
+    hits = search_moves(db.session, group_id, request.args.get('q', ''), limit, offset)
+
+    moves = {m.id: m for m in Move.query.filter(Move.id.in_([hit.id for hit in hits]))} if hits else {}
+    now = datetime.now(timezone.utc)
+    results = []
+    for hit in hits:
+        move = moves.get(hit.id)
+        if move:
+            results.append(dict(
+                move_with_deadline(move, group, now),
+                name_highlight=highlighted(hit.name_highlight),
+                description_snippet=highlighted(hit.description_snippet)
+            ))
+    return jsonify({
+        'results': projected(results),
+        'next_offset': offset + limit if len(hits) == limit else None
+    })
 
 # Create a new move
 @api.route('/groups/<int:group_id>/moves', methods=['POST'])
 def create_move(group_id):
     try:
         data = request.json
-        print(f"Creating move with data: {data}")
+        logger.debug('creating move', extra={'group_id': group_id, 'data': data})
         
         group = Group.query.get_or_404(group_id)
-        print(f"Found group: {group.name}")
+        use_group(group)
         
+        now = datetime.now(timezone.utc)
         new_move = Move(
             name=data['name'],
             description=data.get('description', ''),
             group_id=group_id,
-            created_by=data['created_by']
+            created_by=data['created_by'],
+            created_at=now,
+            expires_at=deadline_for(now, group.vote_deadline_hours)
         )
         db.session.add(new_move)
         db.session.commit()
-        print(f"Move created with ID: {new_move.id}")
-        
-        # Make created_at timezone-aware if it isn't already
-        created_at = new_move.created_at
-        if created_at.tzinfo is None:
-            created_at = created_at.replace(tzinfo=timezone.utc)
+        scheduler.wake()
+        trending.add_move(group_id, new_move.id, now)
         
         # Return move with deadline info like in get_moves
-        move_dict = new_move.to_dict()
-        deadline = created_at + timedelta(hours=group.vote_deadline_hours)
-        now = datetime.now(timezone.utc)
-        time_remaining = (deadline - now).total_seconds()
-        
-        move_dict['deadline'] = deadline.isoformat()
-        move_dict['time_remaining_seconds'] = max(0, time_remaining)
-        move_dict['is_expired'] = time_remaining <= 0
+        move_dict = move_with_deadline(new_move, group)
         
-        print(f"Returning move dict: {move_dict}")
+        logger.info('move created', extra={'move_id': move_dict['id'], 'group_id': group_id})
+        publish(group_channel(group_id), 'move_created', move_dict)
         return jsonify(move_dict), 201
     except Exception as e:
-        print(f"Error creating move: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('error creating move', extra={'group_id': group_id})
         return jsonify({"error": str(e)}), 500
 
 # Update a move
 @api.route('/moves/<int:move_id>', methods=['PUT'])
 def update_move(move_id):
     try:
+        if not use_group_of(Move, move_id):
+            abort(404)
         move = Move.query.get_or_404(move_id)
         group = Group.query.get(move.group_id)
         data = request.json
@@ -86,42 +126,38 @@ def update_move(move_id):
         move.description = data.get('description', move.description)
         db.session.commit()
         
-        # Make created_at timezone-aware if it isn't already
-        created_at = move.created_at
-        if created_at.tzinfo is None:
-            created_at = created_at.replace(tzinfo=timezone.utc)
-        
         # Return move with deadline info
-        move_dict = move.to_dict()
-        deadline = created_at + timedelta(hours=group.vote_deadline_hours)
-        now = datetime.now(timezone.utc)
-        time_remaining = (deadline - now).total_seconds()
-        
-        move_dict['deadline'] = deadline.isoformat()
-        move_dict['time_remaining_seconds'] = max(0, time_remaining)
-        move_dict['is_expired'] = time_remaining <= 0
+        move_dict = move_with_deadline(move, group)
+
+        publish(group_channel(move_dict['group_id']), 'move_updated', move_dict)
         
         return jsonify(move_dict)
     except Exception as e:
-        print(f"Error updating move: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('error updating move', extra={'move_id': move_id})
         return jsonify({"error": str(e)}), 500
 
 # Delete a move
 @api.route('/moves/<int:move_id>', methods=['DELETE'])
 def delete_move(move_id):
-    print(f"Attempting to delete move with ID: {move_id}")
+    if not use_group_of(Move, move_id):
+        abort(404)
     move = Move.query.get_or_404(move_id)
-    print(f"Found move: {move.name}")
+    group_id = move.group_id
     db.session.delete(move)
     db.session.commit()
-    print("Move deleted successfully")
+    trending.remove_moves(group_id, [move_id])
+    logger.info('move deleted', extra={'move_id': move_id, 'group_id': group_id})
+    publish(group_channel(group_id), 'move_deleted', {'id': move_id, 'group_id': group_id})
     return jsonify({"message": "Move deleted"}), 200
 
 @api.route('/test-delete/<int:move_id>', methods=['GET'])
 def test_delete(move_id):
+    if not use_group_of(Move, move_id):
+        abort(404)
     move = Move.query.get_or_404(move_id)
+    group_id = move.group_id
     db.session.delete(move)
     db.session.commit()
+    trending.remove_moves(group_id, [move_id])
+    publish(group_channel(group_id), 'move_deleted', {'id': move_id, 'group_id': group_id})
     return jsonify({"message": f"Move {move_id} deleted"}), 200
\ No newline at end of file
@@ -0,0 +1,131 @@
+import html
+import re
+from sqlalchemy import text
+from shard_router import shard_engine, current_shard
+
+# SQLite FTS5 full-text search over message content and move names/descriptions.
+# The fts tables are external-content indexes over views that add a scope token per
+# row (u<id> for both message participants, g<id> for a move's group), so the
+# per-user / per-group filter is part of the MATCH instead of a post-filter over every
+# hit. Triggers on message and move keep them in sync with every write path, including
+# the expiry sweep's bulk deletes; migrations.py creates everything (move search on
+# every shard) and `flask rebuild-search` rebuilds the indexes from the tables
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# snippet()/highlight() wrap matches in these, the text is HTML-escaped afterwards and
+# they become <mark> tags, so the snippet is safe to render as HTML
+_OPEN = '\x02'
+_CLOSE = '\x03'
+
+FTS_SCHEMA = {'message_fts': [
+    """CREATE VIEW IF NOT EXISTS message_fts_source AS
+       SELECT id, content, 'u' || sender_id || ' u' || recipient_id AS participants FROM message""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+       content, participants, content='message_fts_source', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+       INSERT INTO message_fts(rowid, content, participants)
+       VALUES (new.id, new.content, 'u' || new.sender_id || ' u' || new.recipient_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+       INSERT INTO message_fts(message_fts, rowid, content, participants)
+       VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.recipient_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content, sender_id, recipient_id ON message BEGIN
+       INSERT INTO message_fts(message_fts, rowid, content, participants)
+       VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.recipient_id);
+       INSERT INTO message_fts(rowid, content, participants)
+       VALUES (new.id, new.content, 'u' || new.sender_id || ' u' || new.recipient_id);
+       END""",
+], 'move_fts': [
+    """CREATE VIEW IF NOT EXISTS move_fts_source AS
+       SELECT id, name, description, 'g' || group_id AS group_key FROM move""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS move_fts USING fts5(
+       name, description, group_key, content='move_fts_source', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS move_fts_insert AFTER INSERT ON move BEGIN
+       INSERT INTO move_fts(rowid, name, description, group_key)
+       VALUES (new.id, new.name, new.description, 'g' || new.group_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS move_fts_delete AFTER DELETE ON move BEGIN
+       INSERT INTO move_fts(move_fts, rowid, name, description, group_key)
+       VALUES ('delete', old.id, old.name, old.description, 'g' || old.group_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS move_fts_update AFTER UPDATE OF name, description, group_id ON move BEGIN
+       INSERT INTO move_fts(move_fts, rowid, name, description, group_key)
+       VALUES ('delete', old.id, old.name, old.description, 'g' || old.group_id);
+       INSERT INTO move_fts(rowid, name, description, group_key)
+       VALUES (new.id, new.name, new.description, 'g' || new.group_id);
+       END""",
+]}
+
+FTS_TABLES = tuple(FTS_SCHEMA)
+# extra shards only hold moves (see sharding.py)
+SHARD_FTS_TABLES = ('move_fts',)
+
+
+def create_search_schema(conn, tables=FTS_TABLES):
+    for table in tables:
+        for statement in FTS_SCHEMA[table]:
+            conn.execute(text(statement))
+    rebuild_search_indexes(conn, tables)
+
+
+def rebuild_search_indexes(conn, tables=FTS_TABLES):
+    for table in tables:
+        conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+
+
+def match_expression(query, text_columns, scope_column, scope):
+    # every word the user typed must appear, the last one as a prefix so results follow
+    # the typing; words are quoted so FTS5 syntax in the input is matched literally
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return f"{scope_column}:{scope} AND {{{text_columns}}} : ({' '.join(terms)})"
+
+
+def highlighted(fragment):
+    if fragment is None:
+        return None
+    return html.escape(fragment).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def page_params(args):
+    limit = max(1, min(args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    offset = max(0, args.get('offset', 0, type=int))
+    return limit, offset
+
+
+def search_messages(session, user_id, query, limit, offset):
+    match = match_expression(query, 'content', 'participants', f'u{user_id}')
+    if match is None:
+        return []
+    return session.execute(text(f"""
+        SELECT message_fts.rowid AS id,
+               snippet(message_fts, 0, '{_OPEN}', '{_CLOSE}', '…', 12) AS snippet
+        FROM message_fts
+        WHERE message_fts MATCH :match
+        ORDER BY bm25(message_fts, 1.0, 0.0), message_fts.rowid DESC
+        LIMIT :limit OFFSET :offset
+    """), {'match': match, 'limit': limit, 'offset': offset}).all()
+
+
+def search_moves(session, group_id, query, limit, offset):
+    # a hit in the name counts for more than one in the description; move_fts is on
+    # the group's shard, which the caller has selected
+    match = match_expression(query, 'name description', 'group_key', f'g{group_id}')
+    if match is None:
+        return []
+    return session.execute(text(f"""
+        SELECT move_fts.rowid AS id,
+               highlight(move_fts, 0, '{_OPEN}', '{_CLOSE}') AS name_highlight,
+               snippet(move_fts, 1, '{_OPEN}', '{_CLOSE}', '…', 16) AS description_snippet
+        FROM move_fts
+        WHERE move_fts MATCH :match
+        ORDER BY bm25(move_fts, 10.0, 1.0, 0.0), move_fts.rowid DESC
+        LIMIT :limit OFFSET :offset
+    """), {'match': match, 'limit': limit, 'offset': offset},
+        bind_arguments={'bind': shard_engine(current_shard())}).all()
@@ -1,5 +1,6 @@
 from app import app
 from models import db, User, Group, GroupMember, Move
+from sharding import use_group
 from werkzeug.security import generate_password_hash
 import secrets;
 
@@ -29,6 +30,7 @@ with app.app_context():
     )
     db.session.add(group1)
     db.session.commit()
+    use_group(group1)
 
     # Add users to group
     member1 = GroupMember(group_id=group1.id, user_id=user1.id)
@@ -0,0 +1,134 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import sqlalchemy as sa
+from sqlalchemy.sql.util import find_tables
+from flask import current_app, g
+from flask_sqlalchemy.session import Session
+
+# routes group-scoped tables to the shard selected for the current app context.
+#
+# Models whose __table_args__ end with SHARDED (moves, votes, group members and
+# invitations) live in one of several databases: shard 0 is the main database, shards
+# 1..n are the binds config.SHARD_DATABASE_URLS adds. A route selects the shard once
+# (sharding.use_group) and every ORM query or Core statement on those tables then goes
+# to it; everything else keeps using the main database. With no extra shards configured
+# nothing is routed and the main database holds everything, as before
+
+SHARDED = {'info': {'sharded': True}}
+
+# threads shared by fan_out() calls in this process
+FANOUT_THREADS = 16
+
+
+class ShardNotSelected(RuntimeError):
+    pass
+
+
+def shard_count():
+    return len(current_app.config.get('SHARD_DATABASE_URLS') or ()) + 1
+
+
+def shard_engine(shard):
+    db = current_app.extensions['sqlalchemy']
+    return db.engines[None if shard == 0 else f'shard{shard}']
+
+
+def shard_engines():
+    return [(shard, shard_engine(shard)) for shard in range(shard_count())]
+
+
+def use_shard(shard):
+    g.shard = shard
+
+
+def current_shard():
+    shard = g.get('shard')
+    if shard is None:
+        if shard_count() == 1:
+            return 0
+        raise ShardNotSelected('group-scoped table used before a shard was selected')
+    return shard
+
+
+@contextmanager
+def selected_shard(shard):
+    previous = g.get('shard')
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = previous
+
+
+def is_sharded(table):
+    return isinstance(table, sa.Table) and table.info.get('sharded', False)
+
+
+def _sharded_statement(mapper, clause):
+    # the mapper decides for ORM statements, like Flask-SQLAlchemy's bind keys; Core
+    # statements are sharded when any table they touch is
+    if mapper is not None:
+        return is_sharded(sa.inspect(mapper).local_table)
+    if clause is None:
+        return False
+    if isinstance(clause, sa.Table):
+        return is_sharded(clause)
+    return any(is_sharded(table) for table in find_tables(clause, include_crud=True))
+
+
+class ShardSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shard_count() > 1 and _sharded_statement(mapper, clause):
+            return shard_engine(current_shard())
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=FANOUT_THREADS, thread_name_prefix='shard-fanout')
+        return _pool
+
+
+def _forget_pool():
+    # a forked worker doesn't inherit the parent's threads
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pool)
+
+
+def fan_out(fn):
+    # runs fn() once per shard with that shard selected, returns the results in shard
+    # order. The shard this context already selected runs here on the caller's session,
+    # so it sees the caller's uncommitted writes; the others run in parallel, each in its
+    # own app context and session. Don't call fan_out from inside fn
+    shards = range(shard_count())
+    if len(shards) == 1:
+        with selected_shard(0):
+            return [fn()]
+
+    app = current_app._get_current_object()
+
+    def run(shard):
+        with app.app_context():
+            use_shard(shard)
+            return fn()
+
+    local = g.get('shard')
+    futures = {shard: _executor().submit(run, shard) for shard in shards if shard != local}
+    results = {}
+    if local is not None:
+        results[local] = fn()
+    for shard, future in futures.items():
+        results[shard] = future.result()
+    return [results[shard] for shard in shards]
@@ -0,0 +1,281 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from flask import jsonify
+from sqlalchemy import event, func, select
+from cache import TTLCache
+from models import db, Group, GroupMember, GroupInvitation, Move, Vote, ShardIdBlock
+from shard_router import ShardSession, shard_count, shard_engine, use_shard, fan_out, is_sharded
+from trending import trending
+
+logger = logging.getLogger(__name__)
+
+# which shard holds a group, how routes find it, and moving groups between shards.
+#
+# Group.shard in the main database is the directory; routes call use_group() with the
+# Group row they already loaded, or with an id, which is looked up and cached for
+# SHARD_DIRECTORY_TTL_SECONDS. Moves and invitations addressed only by their own id are
+# found with one primary-key probe per shard (use_group_of). Reads about one user, such
+# as their groups or pending invitations, fan out to every shard in parallel.
+#
+# With extra shards configured, new group-scoped rows get their ids from IdAllocator so
+# an id means the same row whichever shard it is on, and move_group() relocates a group:
+# the group is flagged as moving (its requests get 503 + Retry-After), every worker's
+# directory entry is left to expire, its rows are copied, Group.shard is flipped and
+# the old copies are deleted. There are no cross-shard transactions: a request that
+# writes both a group-scoped table and a main one (invitations and badge counters)
+# commits the two databases one after the other
+
+# rows sent to the target shard per INSERT while moving a group
+COPY_BATCH_SIZE = 500
+
+# every sharded table, in the order rows are copied; deletes go the other way
+GROUP_TABLES = (GroupMember.__table__, GroupInvitation.__table__, Move.__table__, Vote.__table__)
+
+
+class ShardMoving(Exception):
+    def __init__(self, group_id):
+        super().__init__(f"group {group_id} is moving to another shard")
+        self.group_id = group_id
+
+
+# group id -> (shard, moving)
+directory = TTLCache(maxsize=100000, ttl=5)
+# (table, row id) -> group id, for rows found by their own id; rows never change group
+row_groups = TTLCache(maxsize=100000, ttl=3600)
+
+
+def group_shard(group_id):
+    # (shard, moving) for a group, None for an unknown one
+    entry = directory.get(group_id)
+    if entry is None:
+        row = db.session.query(Group.shard, Group.shard_moving).filter(Group.id == group_id).first()
+        if row is None:
+            return None
+        entry = (row.shard, row.shard_moving)
+        directory.set(group_id, entry)
+    return entry
+
+
+def use_group(group):
+    # selects the shard holding a group's rows, given the Group row or its id; returns
+    # False for an unknown id. With a single shard this never queries
+    if shard_count() == 1:
+        use_shard(0)
+        return True
+    if isinstance(group, Group):
+        group_id, entry = group.id, (group.shard, group.shard_moving)
+    else:
+        group_id, entry = group, group_shard(group)
+        if entry is None:
+            return False
+    shard, moving = entry
+    if moving:
+        raise ShardMoving(group_id)
+    use_shard(shard)
+    return True
+
+
+def use_group_of(model, row_id):
+    # selects the shard holding a move or invitation known only by its id; False when
+    # no shard has it
+    if shard_count() == 1:
+        use_shard(0)
+        return True
+    key = (model.__tablename__, row_id)
+    group_id = row_groups.get(key)
+    if group_id is None:
+        found = [group_id for group_id in fan_out(
+            lambda: db.session.query(model.group_id).filter(model.id == row_id).scalar()
+        ) if group_id is not None]
+        if not found:
+            return False
+        group_id = found[0]
+        row_groups.set(key, group_id)
+    return use_group(group_id)
+
+
+def place_group():
+    # shard for a new group; random keeps the shards even on average and
+    # `flask rebalance-shards` evens out what drift there is
+    return random.randrange(shard_count())
+
+
+class IdAllocator:
+    # ids for rows of sharded tables, reserved from ShardIdBlock in blocks of block_size.
+    # Reservations run in their own short transaction on the ids database: a request may
+    # already hold the main database's write lock when it flushes a sharded row (a vote
+    # removed and added in a shard 0 group), so they must not queue behind it. Only the
+    # first reservation for a table looks at what the shards hold
+    def __init__(self, block_size=100):
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, table, count):
+        with self._lock:
+            next_id, end = self._blocks.get(table.name, (0, 0))
+            ids = []
+            while len(ids) < count:
+                if next_id >= end:
+                    next_id, end = self._reserve(table, max(self.block_size, count - len(ids)))
+                taken = min(count - len(ids), end - next_id)
+                ids.extend(range(next_id, next_id + taken))
+                next_id += taken
+            self._blocks[table.name] = (next_id, end)
+            return ids
+
+    def _reserve(self, table, count):
+        blocks = ShardIdBlock.__table__
+        reserve = blocks.update().where(blocks.c.table_name == table.name).values(
+            next_id=blocks.c.next_id + count
+        ).returning(blocks.c.next_id)
+        ids = db.engines['ids']
+        with ids.begin() as conn:
+            end = conn.execute(reserve).scalar()
+        if end is None:
+            # first block for this table: start above every id on any shard
+            highest = max(fan_out(lambda: db.session.query(func.max(table.c.id)).scalar() or 0))
+            with ids.begin() as conn:
+                conn.execute(blocks.insert().prefix_with('OR IGNORE').values(
+                    table_name=table.name, next_id=highest + 1
+                ))
+                end = conn.execute(reserve).scalar()
+        return end - count, end
+
+    def reset(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+allocator = IdAllocator()
+
+
+def assign_ids(table, rows):
+    # ids for rows about to go through a Core insert into a sharded table
+    if shard_count() > 1:
+        for row, row_id in zip(rows, allocator.allocate(table, len(rows))):
+            row['id'] = row_id
+    return rows
+
+
+@event.listens_for(ShardSession, 'before_flush')
+def _assign_flush_ids(session, flush_context, instances):
+    if shard_count() == 1:
+        return
+    pending = defaultdict(list)
+    for instance in session.new:
+        table = instance.__table__
+        if is_sharded(table) and instance.id is None:
+            pending[table].append(instance)
+    for table, instances in pending.items():
+        for instance, row_id in zip(instances, allocator.allocate(table, len(instances))):
+            instance.id = row_id
+
+
+def _in_group(table, group_id):
+    if table is Vote.__table__:
+        moves = Move.__table__
+        return table.c.move_id.in_(select(moves.c.id).where(moves.c.group_id == group_id))
+    return table.c.group_id == group_id
+
+
+def _delete_group_rows(conn, group_id):
+    return {table.name: conn.execute(table.delete().where(_in_group(table, group_id))).rowcount
+            for table in reversed(GROUP_TABLES)}
+
+
+def _copy_group_rows(source, target, group_id):
+    # one transaction on the target; leftovers of an interrupted earlier copy go first
+    copied = {}
+    with source.connect() as src, target.begin() as dst:
+        _delete_group_rows(dst, group_id)
+        for table in GROUP_TABLES:
+            rows = [dict(row._mapping) for row in src.execute(select(table).where(_in_group(table, group_id)))]
+            for start in range(0, len(rows), COPY_BATCH_SIZE):
+                dst.execute(table.insert(), rows[start:start + COPY_BATCH_SIZE])
+            copied[table.name] = len(rows)
+    return copied
+
+
+def purge_strays(group_id, shard):
+    # deletes the group's rows from every shard but its own, e.g. after a move was
+    # interrupted between flipping Group.shard and deleting the old copies
+    for other in range(shard_count()):
+        if other != shard:
+            with shard_engine(other).begin() as conn:
+                _delete_group_rows(conn, group_id)
+
+
+def move_group(group_id, target, settle=None):
+    # moves one group's rows to shard `target`, returns rows copied per table.
+    # settle is how long to wait for other workers to see the group as moving,
+    # by default their directory TTL plus a second for requests already running
+    group = db.session.get(Group, group_id)
+    if group is None:
+        raise ValueError(f"no group {group_id}")
+    if not 0 <= target < shard_count():
+        raise ValueError(f"no shard {target}, there are {shard_count()}")
+    source = group.shard
+    if source == target:
+        # nothing to copy; clears what an interrupted move may have left behind
+        if group.shard_moving:
+            group.shard_moving = False
+            db.session.commit()
+            directory.invalidate(group_id)
+        purge_strays(group_id, target)
+        return {}
+
+    group.shard_moving = True
+    db.session.commit()
+    directory.invalidate(group_id)
+    time.sleep(directory.ttl + 1 if settle is None else settle)
+
+    try:
+        copied = _copy_group_rows(shard_engine(source), shard_engine(target), group_id)
+    except Exception:
+        group.shard_moving = False
+        db.session.commit()
+        raise
+    group.shard = target
+    group.shard_moving = False
+    db.session.commit()
+    directory.invalidate(group_id)
+    trending.invalidate(group_id)
+
+    purge_strays(group_id, target)
+    logger.info('group moved', extra={'group_id': group_id, 'source': source, 'target': target, 'rows': copied})
+    return copied
+
+
+def plan_rebalance():
+    # [(group id, from shard, to shard)] that leave the shards' group counts at most
+    # one apart, moving the newest groups of the fullest shards
+    groups = defaultdict(list)
+    for group_id, shard in db.session.query(Group.id, Group.shard).order_by(Group.id):
+        groups[shard].append(group_id)
+    shards = range(shard_count())
+    plan = []
+    while True:
+        fullest = max(shards, key=lambda shard: len(groups[shard]))
+        emptiest = min(shards, key=lambda shard: len(groups[shard]))
+        if len(groups[fullest]) - len(groups[emptiest]) <= 1:
+            return plan
+        group_id = groups[fullest].pop()
+        groups[emptiest].append(group_id)
+        plan.append((group_id, fullest, emptiest))
+
+
+def init_sharding(app):
+    app.config.setdefault('SHARD_DATABASE_URLS', [])
+    app.config.setdefault('SHARD_DIRECTORY_TTL_SECONDS', 5)
+    directory.ttl = app.config['SHARD_DIRECTORY_TTL_SECONDS']
+
+    @app.errorhandler(ShardMoving)
+    def group_moving(error):
+        response = jsonify({"error": "Group is being moved, try again shortly"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, directory.ttl))
+        return response
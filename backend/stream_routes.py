@@ -0,0 +1,34 @@
+from flask import Blueprint, Response
+from loaders import member_group_ids
+from events import get_broker, user_channel, group_channel, format_sse
+
+stream_bp = Blueprint('stream', __name__)
+
+# seconds between keepalive comments so proxies don't drop idle connections
+KEEPALIVE_SECONDS = 15
+
+# server-sent events for a user: their messages plus vote/move activity in their groups
+@stream_bp.route('/user/<int:user_id>', methods=['GET'])
+def stream_user_events(user_id):
+    # group membership is resolved once per connection, clients reconnect after joining a group
+    channels = [user_channel(user_id)] + [group_channel(group_id) for group_id in member_group_ids(user_id)]
+
+    broker = get_broker()
+    sub = broker.subscribe(channels)
+
+    def generate():
+        try:
+            yield ": connected\n\n"
+            while True:
+                event = sub.get(timeout=KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield format_sse(event)
+        finally:
+            broker.unsubscribe(sub)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
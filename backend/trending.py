@@ -0,0 +1,150 @@
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+from models import db, Move, Vote
+
+# per-group trending ranking of moves. Every vote counts 1, halving every
+# half-life (a quarter of the group's vote_deadline_hours window), and a move's own
+# creation counts as half a vote so fresh moves show up before anyone votes. Decay is the
+# same for every move in a group, so each score is kept as log2 of the sum of
+# 2^(hours since EPOCH / half-life): the ranking then only changes when a vote or move
+# does, and each group keeps a sorted list that toggle_vote, create_move and the expiry
+# sweep update in place. Groups are loaded lazily with one query and reloaded once
+# older than max_age, which bounds how stale other workers' votes can look
+
+EPOCH = datetime(2024, 1, 1)
+HALF_LIVES_PER_WINDOW = 4
+CREATION_WEIGHT = -1.0  # log2(0.5)
+
+
+def hours(when):
+    # DateTime columns come back naive UTC from SQLite
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return (when - EPOCH).total_seconds() / 3600
+
+
+def _log2_add(a, b):
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def _log2_sub(a, b):
+    # None when the difference is too small to keep accurately, the caller reloads
+    if b >= a:
+        return None
+    remainder = 1 - 2 ** (b - a)
+    if remainder < 1e-9:
+        return None
+    return a + math.log2(remainder)
+
+
+class _GroupRanking:
+    def __init__(self, half_life):
+        self.half_life = half_life
+        self.keys = {}
+        self.ranked = []
+        self.loaded_at = time.monotonic()
+
+    def set(self, move_id, key):
+        old = self.keys.get(move_id)
+        if old is not None:
+            i = bisect_left(self.ranked, (-old, move_id))
+            if i < len(self.ranked) and self.ranked[i] == (-old, move_id):
+                del self.ranked[i]
+        self.keys[move_id] = key
+        insort(self.ranked, (-key, move_id))
+
+    def discard(self, move_id):
+        old = self.keys.pop(move_id, None)
+        if old is not None:
+            i = bisect_left(self.ranked, (-old, move_id))
+            if i < len(self.ranked) and self.ranked[i] == (-old, move_id):
+                del self.ranked[i]
+
+
+class TrendingIndex:
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.groups = {}
+        self._lock = threading.Lock()
+
+    def _load(self, group):
+        # the group's moves and votes, from its shard
+        half_life = (group.vote_deadline_hours or 24) / HALF_LIVES_PER_WINDOW
+        rows = db.session.query(Move.id, Move.created_at, Vote.created_at).outerjoin(
+            Vote, Vote.move_id == Move.id
+        ).filter(Move.group_id == group.id).all()
+        ranking = _GroupRanking(half_life)
+        keys = {}
+        for move_id, created_at, voted_at in rows:
+            if move_id not in keys:
+                keys[move_id] = hours(created_at) / half_life + CREATION_WEIGHT
+            if voted_at is not None:
+                keys[move_id] = _log2_add(keys[move_id], hours(voted_at) / half_life)
+        ranking.ranked = sorted((-key, move_id) for move_id, key in keys.items())
+        ranking.keys = keys
+        return ranking
+
+    def _ranking(self, group):
+        ranking = self.groups.get(group.id)
+        if ranking is None or time.monotonic() - ranking.loaded_at > self.max_age:
+            ranking = self._load(group)
+            with self._lock:
+                self.groups[group.id] = ranking
+        return ranking
+
+    def top(self, group, limit):
+        # [(move_id, score now)] best first; the score is the decayed vote count.
+        # group is the Group row, with its shard selected
+        ranking = self._ranking(group)
+        now = hours(datetime.now(timezone.utc)) / ranking.half_life
+        with self._lock:
+            return [(move_id, 2 ** (-neg_key - now)) for neg_key, move_id in ranking.ranked[:limit]]
+
+    # incremental updates after commit, no-ops for groups that aren't loaded
+
+    def add_move(self, group_id, move_id, created_at):
+        with self._lock:
+            ranking = self.groups.get(group_id)
+            if ranking is not None:
+                ranking.set(move_id, hours(created_at) / ranking.half_life + CREATION_WEIGHT)
+
+    def remove_moves(self, group_id, move_ids):
+        with self._lock:
+            ranking = self.groups.get(group_id)
+            if ranking is not None:
+                for move_id in move_ids:
+                    ranking.discard(move_id)
+
+    def vote(self, group_id, move_id, voted_at, added):
+        with self._lock:
+            ranking = self.groups.get(group_id)
+            if ranking is None:
+                return
+            key = ranking.keys.get(move_id)
+            if key is None:
+                # a move created by another worker, pick it up on the next read
+                self.groups.pop(group_id)
+                return
+            weight = hours(voted_at) / ranking.half_life
+            key = _log2_add(key, weight) if added else _log2_sub(key, weight)
+            if key is None:
+                self.groups.pop(group_id)
+            else:
+                ranking.set(move_id, key)
+
+    def invalidate(self, group_id):
+        # the group's vote_deadline_hours (and so its half-life) changed
+        with self._lock:
+            self.groups.pop(group_id, None)
+
+    def stats(self):
+        return {'groups': len(self.groups)}
+
+
+trending = TrendingIndex()
@@ -0,0 +1,142 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from models import db, User
+
+# in-memory username index for typeahead search. Case-folded names are kept in a
+# sorted list so a prefix is one binary search plus a short forward walk, and a
+# trigram index catches typos and matches in the middle of a name. auth.register adds
+# new users as they commit; like the friend graph, each process reloads the whole
+# index once it is older than max_age so other workers' signups show up
+
+FUZZY_MIN_LENGTH = 3
+# trigrams shared by more names than this (e.g. "use" in user1..user99999) don't narrow
+# anything down, fuzzy matching skips them and relies on the rarer ones
+MAX_POSTING = 5000
+
+
+def fold(username):
+    return username.casefold()
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class UsernameIndex:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.names = []
+        self.by_id = {}
+        self.postings = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+
+    def load(self):
+        rows = db.session.query(User.id, User.username).all()
+        by_id = {user_id: fold(username) for user_id, username in rows}
+        postings = defaultdict(list)
+        for user_id, name in by_id.items():
+            for gram in trigrams(name):
+                postings[gram].append(user_id)
+        with self._lock:
+            self.names = sorted((name, user_id) for user_id, name in by_id.items())
+            self.by_id = by_id
+            self.postings = dict(postings)
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at <= self.max_age:
+            return
+        if self._loading.acquire(blocking=self.loaded_at is None):
+            try:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age:
+                    self.load()
+            finally:
+                self._loading.release()
+
+    def add(self, user_id, username):
+        # no-op until the index is first loaded
+        if self.loaded_at is None:
+            return
+        name = fold(username)
+        with self._lock:
+            if user_id in self.by_id:
+                return
+            self.by_id[user_id] = name
+            insort(self.names, (name, user_id))
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, []).append(user_id)
+
+    def prefix(self, query, limit):
+        names = self.names
+        i = bisect_left(names, (query,))
+        matches = []
+        while i < len(names) and len(matches) < limit and names[i][0].startswith(query):
+            matches.append(names[i][1])
+            i += 1
+        return matches
+
+    def fuzzy(self, query, limit):
+        # names sharing the most trigrams with the query, at least half of the ones
+        # that aren't too common to count
+        grams = trigrams(query)
+        counts = defaultdict(int)
+        usable = len(grams)
+        for gram in grams:
+            posting = self.postings.get(gram, ())
+            if len(posting) > MAX_POSTING:
+                usable -= 1
+                continue
+            for user_id in posting:
+                counts[user_id] += 1
+        needed = max(1, usable // 2)
+        return heapq.nsmallest(
+            limit, (user_id for user_id, n in counts.items() if n >= needed),
+            key=lambda user_id: (-counts[user_id], self.by_id[user_id])
+        )
+
+    def search(self, query, limit=10, related=None):
+        # returns [(user_id, match)], match being 'exact', 'prefix' or 'fuzzy'.
+        # `related` maps user ids to a tier (0 = friend, 1 = group co-member, ...);
+        # related users whose name starts with the query come first
+        self.ensure_loaded()
+        query = fold(query.strip())
+        if not query:
+            return []
+
+        def match_kind(name):
+            if name == query:
+                return 'exact'
+            return 'prefix' if name.startswith(query) else None
+
+        first = []
+        for user_id, tier in (related or {}).items():
+            name = self.by_id.get(user_id)
+            if name is not None and name.startswith(query):
+                first.append((tier, name != query, name, user_id))
+        results = {user_id: match_kind(name) for _, _, name, user_id in sorted(first)[:limit]}
+
+        for user_id in self.prefix(query, limit + len(results)):
+            if len(results) >= limit:
+                break
+            results.setdefault(user_id, match_kind(self.by_id[user_id]))
+        if len(results) < limit and len(query) >= FUZZY_MIN_LENGTH:
+            for user_id in self.fuzzy(query, limit):
+                if len(results) >= limit:
+                    break
+                results.setdefault(user_id, 'fuzzy')
+        return list(results.items())
+
+    def stats(self):
+        return {
+            'users': len(self.by_id),
+            'age_seconds': time.monotonic() - self.loaded_at if self.loaded_at is not None else None
+        }
+
+
+username_index = UsernameIndex()
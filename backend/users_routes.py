@@ -0,0 +1,128 @@
+from collections import Counter
+from flask import Blueprint, jsonify
+from sqlalchemy import bindparam, case, func, select, text
+from models import db, UserCounters, Message, GroupInvitation
+from shard_router import fan_out, shard_count
+
+users_bp = Blueprint('users', __name__)
+
+# per-user badge counters. Rows are created lazily: the first write that touches a
+# user without a row computes it from the tables (after flushing, so it already counts
+# that write), every later one is a single UPDATE ... SET col = col + delta
+
+# counts computed from scratch (add a WHERE on u.id), used to create missing rows and
+# by `flask rebuild-badges` / migrations.py to backfill. The group invitation count only
+# covers the main database; with extra shards configured it is replaced by the count
+# from every shard (pending_invitations)
+COUNTERS_SELECT = """
+    SELECT u.id,
+        (SELECT COUNT(*) FROM friendship f WHERE f.friend_id = u.id AND f.status = 'pending'),
+        (SELECT COUNT(*) FROM group_invitation gi WHERE gi.user_id = u.id AND gi.status = 'pending'),
+        (SELECT COALESCE(SUM((SELECT COUNT(*) FROM message m
+            WHERE m.sender_id = cs.peer_id AND m.recipient_id = cs.user_id
+            AND m.id > cs.last_read_message_id)), 0)
+         FROM conversation_summary cs WHERE cs.user_id = u.id)
+    FROM "user" u
+"""
+COUNTERS_INSERT = ("INSERT INTO user_counters (user_id, pending_friend_requests, pending_group_invitations, "
+                   "unread_messages) " + COUNTERS_SELECT)
+
+def pending_invitations(user_ids=None):
+    # {user_id: pending group invitations} summed over the shards, for every user when
+    # user_ids is None
+    def count():
+        query = db.session.query(GroupInvitation.user_id, func.count()).filter(GroupInvitation.status == 'pending')
+        if user_ids is not None:
+            query = query.filter(GroupInvitation.user_id.in_(user_ids))
+        return query.group_by(GroupInvitation.user_id).all()
+    counts = Counter()
+    for rows in fan_out(count):
+        for user_id, pending in rows:
+            counts[user_id] += pending
+    return counts
+
+def _counters_query(sql, user_ids):
+    if user_ids is None:
+        return text(sql), {}
+    return text(
+        sql + " WHERE u.id IN :ids AND u.id NOT IN (SELECT user_id FROM user_counters)"
+    ).bindparams(bindparam('ids', expanding=True)), {'ids': list(user_ids)}
+
+def _insert_counters(user_ids=None):
+    # rows for the given users that have none, or for every user; with a single shard
+    # this is one INSERT ... SELECT
+    if shard_count() == 1:
+        db.session.execute(*_counters_query(COUNTERS_INSERT, user_ids))
+        return
+    rows = db.session.execute(*_counters_query(COUNTERS_SELECT, user_ids)).all()
+    if not rows:
+        return
+    # past a few hundred users one count over the whole table beats a long IN list
+    invitations = pending_invitations(None if len(rows) > 500 else [row[0] for row in rows])
+    db.session.execute(UserCounters.__table__.insert(), [{
+        'user_id': user_id,
+        'pending_friend_requests': friend_requests,
+        'pending_group_invitations': invitations[user_id],
+        'unread_messages': unread
+    } for user_id, friend_requests, _, unread in rows])
+
+def _decremented(counter, amount):
+    return case((counter > amount, counter - amount), else_=0)
+
+def bump_counter(user_ids, column, delta):
+    # add delta to one counter for each user; call after the change itself is in the session
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    db.session.flush()
+    counter = getattr(UserCounters, column)
+    updated = UserCounters.query.filter(UserCounters.user_id.in_(user_ids)).update(
+        {counter: counter + delta if delta > 0 else _decremented(counter, -delta)},
+        synchronize_session=False
+    )
+    if updated < len(user_ids):
+        _insert_counters(user_ids)
+
+def read_messages(user_id, peer_id, old_mark, new_mark):
+    # the reader's mark moved from old_mark to new_mark: that many fewer unread messages
+    count = select(func.count(Message.id)).where(
+        Message.sender_id == peer_id,
+        Message.recipient_id == user_id,
+        Message.id > old_mark,
+        Message.id <= new_mark
+    ).scalar_subquery()
+    db.session.flush()
+    updated = UserCounters.query.filter_by(user_id=user_id).update(
+        {UserCounters.unread_messages: _decremented(UserCounters.unread_messages, count)},
+        synchronize_session=False
+    )
+    if not updated:
+        _insert_counters([user_id])
+
+def rebuild_user_counters():
+    UserCounters.query.delete()
+    _insert_counters()
+    db.session.commit()
+    return UserCounters.query.count()
+
+# everything the nav badges show, one primary-key read
+@users_bp.route('/<int:user_id>/badges', methods=['GET'])
+def get_badges(user_id):
+    counters = db.session.get(UserCounters, user_id)
+    if counters is not None:
+        badges = counters.to_dict()
+    else:
+        # no write has touched this user yet, count without creating the row
+        row = db.session.execute(
+            text(COUNTERS_SELECT + " WHERE u.id = :user_id"), {'user_id': user_id}
+        ).first()
+        badges = {
+            'user_id': user_id,
+            'pending_friend_requests': row[1] if row else 0,
+            'pending_group_invitations': (row[2] if shard_count() == 1 else pending_invitations([user_id])[user_id])
+                                         if row else 0,
+            'unread_messages': row[3] if row else 0
+        }
+    badges['total'] = (badges['pending_friend_requests'] + badges['pending_group_invitations']
+                       + badges['unread_messages'])
+    return jsonify(badges)
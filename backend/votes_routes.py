@@ -1,5 +1,15 @@
-from flask import Blueprint, request, jsonify
-from models import db, Vote, Move, User
+from flask import Blueprint, request, jsonify, abort
+from datetime import datetime, timezone
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+from models import db, Vote, Move
+from events import publish, group_channel
+from expiry import scheduler, request_rescan, utcnow
+from loaders import user_dicts
+from serialization import projected
+from trending import trending
+from sharding import use_group, use_group_of
+from shard_router import fan_out
 
 votes_bp = Blueprint('votes', __name__)
 
@@ -8,55 +18,110 @@ votes_bp = Blueprint('votes', __name__)
 def toggle_vote(move_id):
     data = request.json
     user_id = data['user_id']
-    
-    existing_vote = Vote.query.filter_by(move_id=move_id, user_id=user_id).first()
-    
-    if existing_vote:
-        # remove vote
-        db.session.delete(existing_vote)
+    if not use_group_of(Move, move_id):
+        abort(404)
+    move = Move.query.get_or_404(move_id)
+    group_id, expires_at = move.group_id, move.expires_at
+
+    # delete first: if a vote existed this is the whole toggle, no read-then-write window.
+    # RETURNING hands back the vote's time so the trending score can take it back out
+    removed = db.session.execute(
+        delete(Vote).where(Vote.move_id == move_id, Vote.user_id == user_id).returning(Vote.created_at)
+    ).scalars().all()
+    if removed:
+        _adjust_vote_count(move_id, -len(removed))
+        # the sweeper only looks at moves expiring since its last run, and this one may
+        # just have dropped below its group's requirement
+        rescan = expires_at is not None and expires_at <= utcnow()
+        if rescan:
+            request_rescan()
         db.session.commit()
+        for voted_at in removed:
+            trending.vote(group_id, move_id, voted_at, added=False)
+        if rescan:
+            scheduler.wake()
+        publish(group_channel(group_id), 'vote', {'move_id': move_id, 'group_id': group_id, 'user_id': user_id, 'voted': False})
         return jsonify({"message": "Vote removed", "voted": False})
-    else:
-        # add vote
-        new_vote = Vote(
-            move_id=move_id,
-            user_id=user_id
-        )
-        db.session.add(new_vote)
+
+    # add vote
+    new_vote = Vote(
+        move_id=move_id,
+        user_id=user_id,
+        created_at=datetime.now(timezone.utc)
+    )
+    db.session.add(new_vote)
+    _adjust_vote_count(move_id, 1)
+    try:
         db.session.commit()
+    except IntegrityError:
+        # a concurrent request already added this vote
+        db.session.rollback()
         return jsonify({"message": "Vote added", "voted": True})
+    trending.vote(group_id, move_id, new_vote.created_at, added=True)
+    publish(group_channel(group_id), 'vote', {'move_id': move_id, 'group_id': group_id, 'user_id': user_id, 'voted': True})
+    return jsonify({"message": "Vote added", "voted": True})
+
+def _adjust_vote_count(move_id, delta):
+    Move.query.filter_by(id=move_id).update(
+        {Move.vote_count: Move.vote_count + delta}, synchronize_session=False
+    )
+
+def reconcile_vote_counts():
+    # drop duplicate votes left from before the unique constraint, then rebuild every
+    # Move.vote_count from the Vote table, on every shard; returns (duplicates removed,
+    # moves updated)
+    def reconcile():
+        keep_ids = db.session.query(func.min(Vote.id)).group_by(Vote.move_id, Vote.user_id)
+        duplicates = Vote.query.filter(Vote.id.not_in(keep_ids)).delete(synchronize_session=False)
+
+        counted = select(func.count(Vote.id)).where(Vote.move_id == Move.id).correlate(Move).scalar_subquery()
+        updated = Move.query.update({Move.vote_count: counted}, synchronize_session=False)
+        db.session.commit()
+        return duplicates, updated
+    results = fan_out(reconcile)
+    return sum(duplicates for duplicates, _ in results), sum(updated for _, updated in results)
 
 # get votes for a move
 @votes_bp.route('/move/<int:move_id>', methods=['GET'])
 def get_move_votes(move_id):
-    votes = Vote.query.filter_by(move_id=move_id).all()
+    votes = Vote.query.filter_by(move_id=move_id).all() if use_group_of(Move, move_id) else []
     
+    users = user_dicts(vote.user_id for vote in votes)
+
     vote_list = []
     for vote in votes:
-        user = User.query.get(vote.user_id)
+        user = users.get(vote.user_id)
         if user:
             vote_list.append({
                 'id': vote.id,
-                'user': user.to_dict(),
+                'user': user,
                 'created_at': vote.created_at.isoformat()
             })
     
-    return jsonify({
+    return jsonify(projected({
         'vote_count': len(vote_list),
         'votes': vote_list
-    })
+    }))
 
 # get all votes for moves in a group
 @votes_bp.route('/group/<int:group_id>', methods=['GET'])
 def get_group_votes(group_id):
-    moves = Move.query.filter_by(group_id=group_id).all()
-    
-    votes_data = {}
-    for move in moves:
-        votes = Vote.query.filter_by(move_id=move.id).all()
-        votes_data[move.id] = {
-            'vote_count': len(votes),
-            'voter_ids': [v.user_id for v in votes]
-        }
-    
-    return jsonify(votes_data) 
\ No newline at end of file
+    if not use_group(group_id):
+        return jsonify({})
+    return jsonify(group_votes_summary(group_id))
+
+# counts come from Move.vote_count, voter ids from one join instead of a query per move;
+# the group's shard must already be selected
+def group_votes_summary(group_id, moves=None):
+    if moves is None:
+        moves = db.session.query(Move.id, Move.vote_count).filter(Move.group_id == group_id).all()
+    votes_data = {move.id: {'vote_count': move.vote_count, 'voter_ids': []} for move in moves}
+
+    votes = db.session.query(Vote.move_id, Vote.user_id).join(
+        Move, Move.id == Vote.move_id
+    ).filter(Move.group_id == group_id).order_by(Vote.id).all()
+    for move_id, user_id in votes:
+        if move_id in votes_data:
+            votes_data[move_id]['voter_ids'].append(user_id)
+
+    return votes_data 
\ No newline at end of file
@@ -0,0 +1,9 @@
+from factory import create_app
+from config import ProductionConfig
+
+# production entry point:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#   waitress-serve --threads=16 --port=5000 wsgi:app      (Windows)
+# run the expiry scheduler next to it with `flask --app wsgi expiry-worker`, and
+# archive old messages from cron with `flask --app wsgi archive-messages`
+app = create_app(ProductionConfig)
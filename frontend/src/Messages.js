@@ -1,24 +1,49 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
+import { subscribe } from './eventStream';
 
 function Messages({ user, selectedFriend, onClose }) {
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState('');
+  const lastMessageId = useRef(null);
 
   useEffect(() => {
     if (selectedFriend) {
+      setMessages([]);
+      lastMessageId.current = null;
       fetchConversation();
-      const interval = setInterval(fetchConversation, 3000);
-      return () => clearInterval(interval);
+
+      // the server pushes new messages, polling is only a slow fallback
+      const unsubscribe = subscribe(user.id, ['message'], (msg) => {
+        if (msg.sender_id === selectedFriend.id || msg.recipient_id === selectedFriend.id) {
+          fetchConversation();
+        }
+      });
+      const interval = setInterval(fetchConversation, 30000);
+      return () => {
+        unsubscribe();
+        clearInterval(interval);
+      };
     }
   }, [selectedFriend]);
 
   const fetchConversation = () => {
     if (!selectedFriend) return;
-    
-    axios.get(`http://localhost:5000/messages/conversation/${user.id}/${selectedFriend.id}`)
+
+    // first load grabs the latest page, later polls only ask for what's new
+    const params = lastMessageId.current === null
+      ? { limit: 50 }
+      : { after_id: lastMessageId.current };
+
+    axios.get(`http://localhost:5000/messages/conversation/${user.id}/${selectedFriend.id}`, { params })
       .then(response => {
-        setMessages(response.data);
+        const newMessages = response.data;
+        if (newMessages.length === 0) return;
+        lastMessageId.current = newMessages[newMessages.length - 1].id;
+        setMessages(prev => {
+          const seen = new Set(prev.map(msg => msg.id));
+          return [...prev, ...newMessages.filter(msg => !seen.has(msg.id))];
+        });
       })
       .catch(error => {
         console.error('Error fetching messages:', error);
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { subscribe } from './eventStream';
 import CreateMove from './CreateMove';
 import EditMove from './EditMove';
 
@@ -12,65 +13,46 @@ function MovesList({ user, groupId }) {
   const [currentTime, setCurrentTime] = useState(Date.now());
 
   useEffect(() => {
-    axios.post(`http://localhost:5000/groups/${groupId}/cleanup-moves`)
-      .then(() => {
-        fetchMoves();
-        fetchVotes();
-        fetchGroupSettings();
-      })
-      .catch(error => {
-        console.error('Error cleaning up moves:', error);
-        fetchMoves();
-        fetchVotes();
-        fetchGroupSettings();
-      });
+    // Expired moves are removed by the server in the background
+    fetchBoard();
+
+    // Refresh when someone in the group votes or changes a move
+    const unsubscribe = subscribe(user.id, ['vote', 'move_created', 'move_updated', 'move_deleted'], (data) => {
+      if (data.group_id === groupId) fetchBoard();
+    });
 
     // Update current time every second for countdown
     const interval = setInterval(() => {
       setCurrentTime(Date.now());
     }, 1000);
 
-    return () => clearInterval(interval);
+    return () => {
+      unsubscribe();
+      clearInterval(interval);
+    };
   }, [groupId]);
 
-  const fetchMoves = () => {
-    axios.get(`http://localhost:5000/api/groups/${groupId}/moves`)
+  // Moves, votes and settings come from one request; unchanged boards revalidate with a 304
+  const fetchBoard = () => {
+    axios.get(`http://localhost:5000/groups/${groupId}/board`)
       .then(response => {
-        setMoves(response.data);
+        setMoves(response.data.moves);
+        setVotesData(response.data.votes);
+        setGroupSettings(response.data.settings);
         setLoading(false);
       })
       .catch(error => {
-        console.error('Error fetching moves:', error);
+        console.error('Error fetching board:', error);
         setLoading(false);
       });
   };
 
-  const fetchVotes = () => {
-    axios.get(`http://localhost:5000/votes/group/${groupId}`)
-      .then(response => {
-        setVotesData(response.data);
-      })
-      .catch(error => {
-        console.error('Error fetching votes:', error);
-      });
-  };
-
-  const fetchGroupSettings = () => {
-    axios.get(`http://localhost:5000/groups/${groupId}/settings`)
-      .then(response => {
-        setGroupSettings(response.data);
-      })
-      .catch(error => {
-        console.error('Error fetching group settings:', error);
-      });
-  };
-
   const handleVote = (moveId) => {
     axios.post(`http://localhost:5000/votes/move/${moveId}/vote`, {
       user_id: user.id
     })
       .then(response => {
-        fetchVotes();
+        fetchBoard();
       })
       .catch(error => {
         console.error('Error voting:', error);
@@ -87,8 +69,7 @@ function MovesList({ user, groupId }) {
       })
         .then(response => {
           alert('Move deleted successfully!');
-          fetchMoves();
-          fetchVotes();
+          fetchBoard();
         })
         .catch(error => {
           console.error('Error deleting move:', error);
@@ -103,7 +84,7 @@ function MovesList({ user, groupId }) {
 
   const handleUpdateComplete = () => {
     setEditingMoveId(null);
-    fetchMoves();
+    fetchBoard();
   };
 
   const formatTimeRemaining = (seconds) => {
@@ -129,7 +110,7 @@ function MovesList({ user, groupId }) {
 
   return (
     <div>
-      <CreateMove groupId={groupId} onMoveCreated={() => { fetchMoves(); fetchVotes(); }} user={user} />
+      <CreateMove groupId={groupId} onMoveCreated={fetchBoard} user={user} />
       
       {moves.length === 0 ? (
         <div className="text-center py-12 bg-gray-50 rounded-lg border-2 border-dashed border-gray-300 mt-6">
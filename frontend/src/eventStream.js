@@ -0,0 +1,64 @@
+// One EventSource per user, shared by every component that listens, so switching
+// chats or groups doesn't open a new /stream connection each time. The connection
+// closes a few seconds after the last listener goes away; switching views unsubscribes
+// and subscribes again straight away, which keeps it open.
+
+const RETRY_MS = 5000;
+const CLOSE_DELAY_MS = 5000;
+
+const streams = {};
+
+function open(stream, userId) {
+  stream.source = new EventSource(`http://localhost:5000/stream/user/${userId}`);
+  Object.keys(stream.dispatchers).forEach(type => {
+    stream.source.addEventListener(type, stream.dispatchers[type]);
+  });
+  stream.source.onerror = () => {
+    // the browser retries dropped connections itself, but gives up after a non-200
+    // response such as a 429
+    if (stream.source.readyState === EventSource.CLOSED && !stream.retry) {
+      stream.retry = setTimeout(() => {
+        stream.retry = null;
+        if (streams[userId] === stream) open(stream, userId);
+      }, RETRY_MS);
+    }
+  };
+}
+
+function close(stream, userId) {
+  clearTimeout(stream.retry);
+  stream.source.close();
+  delete streams[userId];
+}
+
+// calls handler(data) for each event of the given types; returns the unsubscribe function
+export function subscribe(userId, types, handler) {
+  let stream = streams[userId];
+  if (!stream) {
+    stream = { source: null, retry: null, closing: null, handlers: {}, dispatchers: {} };
+    streams[userId] = stream;
+    open(stream, userId);
+  }
+  clearTimeout(stream.closing);
+  stream.closing = null;
+
+  types.forEach(type => {
+    if (!stream.handlers[type]) {
+      stream.handlers[type] = new Set();
+      stream.dispatchers[type] = (event) => {
+        const data = JSON.parse(event.data);
+        stream.handlers[type].forEach(listener => listener(data));
+      };
+      stream.source.addEventListener(type, stream.dispatchers[type]);
+    }
+    stream.handlers[type].add(handler);
+  });
+
+  return () => {
+    types.forEach(type => stream.handlers[type].delete(handler));
+    if (Object.values(stream.handlers).every(listeners => listeners.size === 0)) {
+      clearTimeout(stream.closing);
+      stream.closing = setTimeout(() => close(stream, userId), CLOSE_DELAY_MS);
+    }
+  };
+}